@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+# Generates reports for a list of addresses. Results are appended to a JSONL
+# file as they complete, one line per input row tagged with its row index;
+# rerunning with the same output skips the rows already there, so an
+# interrupted run resumes where it stopped.
+
+import argparse
+import collections
+import csv
+import datetime
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent import futures
+
+import config
+import metrics
+import report
+import upstream
+
+def read_addresses(path, column):
+    with open(path, newline="") as f:
+        if path.endswith(".jsonl") or path.endswith(".json"):
+            for i, line in enumerate(f):
+                if line.strip():
+                    row = json.loads(line)
+                    yield i, row[column] if isinstance(row, dict) else row
+        else:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            index = header.index(column) if column in header else 0
+            if header and column not in header:
+                # No header row: every line is an address.
+                yield 0, header[0]
+            for i, row in enumerate(reader, 1):
+                if row:
+                    yield i, row[index]
+
+# Indices already in the output. A line cut short by a crash is dropped, and
+# reports with unavailable sections don't count, so a rerun retries them (the
+# last line for an index is the one that stands).
+def load_checkpoint(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        content = f.read()
+        end = content.rfind(b"\n") + 1
+        if end < len(content):
+            f.truncate(end)
+    for line in content[:end].splitlines():
+        try:
+            row = json.loads(line.decode("utf-8"))
+            if row.get("unavailable"):
+                done.discard(row["index"])
+            else:
+                done.add(row["index"])
+        except (ValueError, KeyError):
+            pass
+    return done
+
+def run(index, address, executor):
+    start = time.time()
+    out = { "index": index, "address": address }
+    try:
+        query, error = report.locate(address)
+        if error:
+            out.update({ "status": "not_found", "error": error })
+        else:
+            timings = {}
+            sections, unavailable = report.fetch_sections(query, timings=timings, executor=executor)
+            out.update({
+                "status": "ok",
+                "place_id": query["place_id"],
+                "lat": query["lat"],
+                "lng": query["lng"],
+                "sections": sections,
+                "unavailable": unavailable,
+                "timings": timings
+            })
+    except Exception as e:
+        traceback.print_exc()
+        out.update({ "status": "error", "error": "{}: {}".format(type(e).__name__, e) })
+    out["elapsed"] = time.time() - start
+    return out
+
+class Stats(object):
+
+    def __init__(self, every=50):
+        self.every = every
+        self.start = time.time()
+        self.statuses = collections.Counter()
+        self.unavailable = collections.Counter()
+        self.latency = collections.defaultdict(list)
+
+    def add(self, result):
+        self.statuses[result["status"]] += 1
+        self.latency["report"].append(result["elapsed"])
+        for name, seconds in result.get("timings", {}).items():
+            self.latency[name].append(seconds)
+        self.unavailable.update(result.get("unavailable", []))
+        if sum(self.statuses.values()) % self.every == 0:
+            self.report()
+
+    def report(self, done=False):
+        total = sum(self.statuses.values())
+        elapsed = max(time.time() - self.start, 1e-9)
+        print("{}{} reports, {:.2f}/s, {} ok, {} not found, {} errors ({:.1%})".format(
+            "done, " if done else "", total, total / elapsed, self.statuses["ok"], self.statuses["not_found"],
+            self.statuses["error"], self.statuses["error"] / float(max(total, 1))), file=sys.stderr)
+        if done:
+            print("{:<16} {:>8} {:>8} {:>8} {:>12}".format("section", "p50 ms", "p95 ms", "max ms", "unavailable"), file=sys.stderr)
+            for name in ["report"] + [x for x in report.SECTIONS if x in self.latency]:
+                values = self.latency[name]
+                print("{:<16} {:>8.0f} {:>8.0f} {:>8.0f} {:>12}".format(
+                    name, metrics.percentile(values, 50) * 1000, metrics.percentile(values, 95) * 1000, max(values) * 1000, self.unavailable[name]), file=sys.stderr)
+
+def encode(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate reports for a CSV or JSONL list of addresses.")
+    parser.add_argument("input", help="CSV (with an address column, or one address per line) or JSONL")
+    parser.add_argument("--output", help="JSONL results, also the resume checkpoint (default: <input>.reports.jsonl)")
+    parser.add_argument("--column", default="address", help="address column or JSONL key (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=8, help="reports in flight at once (default: %(default)s)")
+    parser.add_argument("--rate", action="append", default=[], metavar="HOST=RPS",
+                        help="cap requests per second to an upstream host; repeatable")
+    parser.add_argument("--queue-timeout", type=float, metavar="SECONDS",
+                        help="give up on a request after waiting this long for its --rate turn or a free connection (default: wait)")
+    args = parser.parse_args()
+
+    # Nobody is waiting on a page, so rate caps pace requests instead of
+    # failing them, and sections take as long as that makes them.
+    config.UPSTREAM_QUEUE_TIMEOUT = args.queue_timeout
+    config.SECTION_TIMEOUT = None
+    config.SECTION_TIMEOUTS = {}
+
+    for spec in args.rate:
+        host, rate = spec.split("=", 1)
+        upstream.set_rate_limit(host, float(rate))
+
+    output = args.output or os.path.splitext(args.input)[0] + ".reports.jsonl"
+    done = load_checkpoint(output)
+    if done:
+        print("resuming: {} rows already done".format(len(done)), file=sys.stderr)
+    # Each report fans out into one task per section.
+    sections = futures.ThreadPoolExecutor(max_workers=args.workers * len(report.SECTIONS))
+    workers = futures.ThreadPoolExecutor(max_workers=args.workers)
+    stats = Stats()
+    pending = set()
+    with open(output, "a") as out:
+
+        def flush():
+            finished, rest = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            pending.intersection_update(rest)
+            for future in finished:
+                result = future.result()
+                out.write(json.dumps(result, default=encode) + "\n")
+                stats.add(result)
+            out.flush()
+
+        for index, address in read_addresses(args.input, args.column):
+            if index in done:
+                continue
+            if len(pending) >= args.workers * 2:
+                flush()
+            pending.add(workers.submit(run, index, address, sections))
+        while pending:
+            flush()
+    workers.shutdown()
+    sections.shutdown()
+    stats.report(done=True)
+
+if __name__ == "__main__":
+    main()
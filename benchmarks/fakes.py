@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+
+# Local stand-ins for the upstream APIs: Google Geocoding and Places, Zillow,
+# the school finder, and the Census geocoder and data API. They replay the
+# recorded responses in fixtures/, filled in for the address or point asked
+# about, after an injected delay; a share of requests can be failed with a 503.
+#
+#   python benchmarks/fakes.py --latency 80 --latency zillow=300 --error-rate 0.01
+#
+# prints each service's base URL and serves until interrupted. For the census
+# client, point census.core.ENDPOINT_URL at "<census url>/data/%s/%s".
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import random
+import re
+import socketserver
+import string
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import escape
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# Fake addresses land within SPREAD degrees of CENTER.
+CENTER = (39.9526, -75.1652)
+SPREAD = 0.08
+# The config setting holding each service's base URL.
+CONFIG_URLS = {
+    "google": "GOOGLE_MAPS_URL",
+    "zillow": "ZILLOW_URL",
+    "schools": "SCHOOL_FINDER_URL",
+    "census": "CENSUS_GEOCODER_URL"
+}
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+def digest(*parts):
+    return hashlib.sha1(" ".join(str(x).lower() for x in parts).encode("utf-8")).hexdigest()
+
+# The same address always gets the same point.
+def point(*parts):
+    h = int(digest(*parts)[:12], 16)
+    return round(CENTER[0] + ((h & 0xffffff) / 0xffffff * 2 - 1) * SPREAD, 7), round(CENTER[1] + ((h >> 24) / 0xffffff * 2 - 1) * SPREAD, 7)
+
+ADDRESS = re.compile(r"^\s*(?:(\d+)\s+)?([^,]+)")
+ZIPCODE = re.compile(r"\b(\d{5})\b")
+
+# (number, street, zipcode) from a one-line address.
+def parse_address(address):
+    m = ADDRESS.match(address or "")
+    z = ZIPCODE.search(address or "")
+    return (m.group(1), m.group(2).strip()) if m else (None, ""), z.group(1) if z else "19140"
+
+class Faults(object):
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+    def fail(self):
+        return random.random() < self.error_rate
+
+class Google(object):
+
+    def __init__(self):
+        self.geocode = json.loads(fixture("geocode.json"))
+        self.nearby = json.loads(fixture("nearbysearch.json"))
+        self.origin = self.geocode["results"][0]["geometry"]["location"]
+        # Places handed out by geocode, for place_id lookups.
+        self.places = {}
+        self._lock = threading.Lock()
+
+    def routes(self):
+        return [
+            (r"/maps/api/geocode/json", self.get_geocode),
+            (r"/maps/api/place/nearbysearch/json", self.get_nearby)
+        ]
+
+    def result(self, address):
+        (number, street), zipcode = parse_address(address)
+        if not street:
+            return None
+        out = copy.deepcopy(self.geocode["results"][0])
+        parts = { "street_number": number, "route": street, "postal_code": zipcode }
+        out["address_components"] = [dict(x, long_name=parts[x["types"][0]], short_name=parts[x["types"][0]]) if x["types"][0] in parts else x
+                                     for x in out["address_components"] if x["types"][0] != "street_number" or number]
+        lat, lng = point(number, street, zipcode)
+        out["geometry"]["location"] = { "lat": lat, "lng": lng }
+        out["geometry"]["viewport"] = {
+            "northeast": { "lat": lat + 0.0013490, "lng": lng + 0.0013490 },
+            "southwest": { "lat": lat - 0.0013490, "lng": lng - 0.0013490 }
+        }
+        out["formatted_address"] = "{}{}, Philadelphia, PA {}, USA".format(number + " " if number else "", street, zipcode)
+        out["place_id"] = "Fake" + digest(number, street, zipcode)[:23]
+        out["types"] = ["street_address"] if number else ["route"]
+        return out
+
+    def get_geocode(self, params):
+        if "place_id" in params:
+            with self._lock:
+                result = self.places.get(params["place_id"])
+        else:
+            result = self.result(params.get("address"))
+            if result is not None:
+                with self._lock:
+                    self.places[result["place_id"]] = result
+        if result is None:
+            return json_response({ "results": [], "status": "ZERO_RESULTS" })
+        return json_response({ "results": [result], "status": "OK" })
+
+    # The recorded places, moved to surround the point asked about.
+    def get_nearby(self, params):
+        lat, lng = [float(x) for x in params["location"].split(",")]
+        types = set(params.get("types", "").split("|"))
+        dlat, dlng = lat - self.origin["lat"], lng - self.origin["lng"]
+        results = []
+        for x in self.nearby["results"]:
+            if types.isdisjoint(x["types"]):
+                continue
+            x = copy.deepcopy(x)
+            loc = x["geometry"]["location"]
+            x["geometry"]["location"] = { "lat": loc["lat"] + dlat, "lng": loc["lng"] + dlng }
+            results.append(x)
+        return json_response({ "html_attributions": [], "results": results, "status": "OK" if results else "ZERO_RESULTS" })
+
+class Zillow(object):
+
+    def __init__(self):
+        self.templates = { name: string.Template(fixture(name + ".xml")) for name in ("GetDeepSearchResults", "GetZestimate", "GetUpdatedPropertyDetails") }
+
+    def routes(self):
+        return [(r"/webservice/(\w+)\.htm", self.webservice)]
+
+    def webservice(self, params, name):
+        if name not in self.templates:
+            return 404, "text/plain", "not found"
+        fields = { "zpid": params.get("zpid", "") }
+        if name == "GetDeepSearchResults":
+            (number, street), zipcode = parse_address(params.get("address", "") + ", " + params.get("citystatezip", ""))
+            lat, lng = point(number, street, zipcode)
+            fields = {
+                "zpid": 10000000 + int(digest(number, street, zipcode)[:8], 16) % 90000000,
+                "street": escape(params.get("address", "")),
+                "citystatezip": escape(params.get("citystatezip", "")),
+                "zipcode": zipcode,
+                "slug": re.sub(r"[^\w]+", "-", "{} {} Philadelphia PA {}".format(number, street, zipcode)).strip("-"),
+                "lat": lat,
+                "lng": lng
+            }
+        return 200, "text/xml; charset=utf-8", self.templates[name].substitute(fields)
+
+class Schools(object):
+
+    def __init__(self):
+        self.page = fixture("school_finder.html")
+
+    def routes(self):
+        return [(r"/school_finder/ajax/pip/([-\d.]+)/([-\d.]+)", self.pip)]
+
+    def pip(self, params, lat, lng):
+        return 200, "text/html; charset=utf-8", self.page
+
+class Census(object):
+
+    def __init__(self):
+        self.geocoder = string.Template(fixture("census_geocoder.json"))
+
+    def routes(self):
+        return [
+            (r"/geocoder/locations/onelineaddress/?", self.onelineaddress),
+            (r"/data/(\d+)/([\w/]+)", self.data)
+        ]
+
+    def onelineaddress(self, params):
+        address = params.get("address", "")
+        (number, street), zipcode = parse_address(address)
+        lat, lng = point(number, street, zipcode)
+        return 200, "application/json", self.geocoder.substitute({
+            "address": json.dumps(address)[1:-1],
+            "matched": json.dumps("{} {}, PHILADELPHIA, PA, {}".format(number or "", street, zipcode).strip().upper())[1:-1],
+            "zipcode": zipcode,
+            "lat": lat,
+            "lng": lng
+        })
+
+    # Rows of made-up values shaped like the data API's: a header row of the
+    # requested fields plus the geography columns, then one row per place
+    # ("*" asks for three).
+    def data(self, params, year, dataset):
+        fields = [x for x in params.get("get", "").split(",") if x]
+        if not fields or "for" not in params:
+            return 400, "text/plain", "error: missing 'get' or 'for'"
+        level, code = params["for"].rsplit(":", 1)
+        within = [x.split(":", 1) for x in params.get("in", "").split()]
+        header = fields + [x[0] for x in within] + [level]
+        rows = [header]
+        for code in (["001", "002", "003"] if code == "*" else [code]):
+            place = [x[1] for x in within] + [code]
+            rows.append([("Fake {} {}".format(level, code) if field == "NAME" else str(int(digest(year, dataset, field, *place)[:6], 16)))
+                         for field in fields] + place)
+        return json_response(rows)
+
+def json_response(value):
+    return 200, "application/json; charset=utf-8", json.dumps(value)
+
+class Handler(BaseHTTPRequestHandler):
+
+    # Keep-alive, like the real services.
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.handle_request(parse_qs(urlsplit(self.path).query))
+
+    def do_POST(self):
+        params = parse_qs(urlsplit(self.path).query)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+        params.update(parse_qs(body))
+        self.handle_request(params)
+
+    def handle_request(self, params):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        server.faults.delay()
+        if server.faults.fail():
+            return self.respond(503, "text/plain", "injected failure")
+        path = urlsplit(self.path).path
+        params = { k: v[0] for k, v in params.items() }
+        for pattern, fn in server.routes:
+            m = re.match(pattern + "$", path)
+            if m:
+                return self.respond(*fn(params, *m.groups()))
+        self.respond(404, "text/plain", "not found")
+
+    def respond(self, status, content_type, body):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class Server(socketserver.ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, service, faults, port=0):
+        HTTPServer.__init__(self, ("127.0.0.1", port), Handler)
+        self.routes = service.routes()
+        self.faults = faults
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+SERVICES = {
+    "google": Google,
+    "zillow": Zillow,
+    "schools": Schools,
+    "census": Census
+}
+
+# Starts every service on its own port. `faults` maps service names to
+# Faults; the others get none.
+def start(faults=None):
+    faults = faults or {}
+    return { name: Server(cls(), faults.get(name, Faults())).start() for name, cls in SERVICES.items() }
+
+def stop(servers):
+    for server in servers.values():
+        server.shutdown()
+        server.server_close()
+
+# Points the config module at the servers. The limits configured for each
+# real host carry over to its stand-in, so the client side behaves as it
+# would in production; rate_limits=False leaves only the concurrency caps.
+def redirect(config, servers, rate_limits=True):
+    for name, server in servers.items():
+        host = urlsplit(getattr(config, CONFIG_URLS[name])).netloc
+        fake = urlsplit(server.url).netloc
+        for limits in (config.UPSTREAM_HOST_LIMITS,) + ((config.UPSTREAM_RATE_LIMITS, config.UPSTREAM_KEY_RATE_LIMITS) if rate_limits else ()):
+            if host in limits:
+                limits[fake] = limits[host]
+        setattr(config, CONFIG_URLS[name], server.url)
+
+# "80" sets the default for every service, "zillow=300" one service's.
+def parse_specs(specs, scale=1.0):
+    out = {}
+    for spec in specs:
+        name, _, value = spec.rpartition("=")
+        if name and name not in SERVICES:
+            raise ValueError("unknown service {!r}; expected one of {}".format(name, ", ".join(sorted(SERVICES))))
+        out[name or None] = float(value) * scale
+    return out
+
+def faults_from_args(args):
+    latency = parse_specs(args.latency, 0.001)
+    jitter = parse_specs(args.jitter, 0.001)
+    errors = parse_specs(args.error_rate)
+    return { name: Faults(latency.get(name, latency.get(None, 0.0)), jitter.get(name, jitter.get(None, 0.0)), errors.get(name, errors.get(None, 0.0)))
+             for name in SERVICES }
+
+def add_arguments(parser):
+    parser.add_argument("--latency", action="append", default=[], metavar="[SERVICE=]MS", help="mean injected delay; repeatable")
+    parser.add_argument("--jitter", action="append", default=[], metavar="[SERVICE=]MS", help="standard deviation of the delay; repeatable")
+    parser.add_argument("--error-rate", action="append", default=[], metavar="[SERVICE=]P", help="share of requests answered 503; repeatable")
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve local stand-ins for the upstream APIs.")
+    add_arguments(parser)
+    args = parser.parse_args()
+    servers = start(faults_from_args(args))
+    for name in sorted(servers):
+        print("{:<8} {}  ({} = {!r})".format(name, servers[name].url, CONFIG_URLS[name], servers[name].url))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stop(servers)
+
+if __name__ == "__main__":
+    main()
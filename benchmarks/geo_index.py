@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# Compares the legacy 2d incident queries against the 2dsphere + compound time
+# index path on a synthetic city-sized dataset. Writes to a scratch database
+# (homie_bench by default), never to the live collections.
+#
+#   python benchmarks/geo_index.py --crimes 2000000 --queries 200
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import data
+import db
+import metrics
+
+CENTER = (39.9526, -75.1652)
+SPREAD = 0.15
+TYPES = ["Thefts", "Other Assaults", "Vandalism/Criminal Mischief", "Theft from Vehicle", "Narcotic / Drug Law Violations",
+         "Fraud", "Burglary Residential", "Aggravated Assault No Firearm", "Robbery No Firearm", "Motor Vehicle Theft"]
+
+def random_point():
+    return [CENTER[1] + random.gauss(0, SPREAD / 2), CENTER[0] + random.gauss(0, SPREAD / 2)]
+
+def crime_docs(n, now):
+    for _ in range(n):
+        coord = random_point()
+        yield {
+            "coord": coord,
+            "loc": { "type": "Point", "coordinates": coord },
+            "type": random.choice(TYPES),
+            "time": now - datetime.timedelta(seconds=random.randint(0, 10 * 365 * 86400))
+        }
+
+def collision_docs(n, now):
+    for _ in range(n):
+        coord = random_point()
+        yield {
+            "coord": coord,
+            "loc": { "type": "Point", "coordinates": coord },
+            "year": now.year - random.randint(0, 9),
+            "month": random.randint(1, 12)
+        }
+
+def seed(database, crimes, collisions, batch_size):
+    now = datetime.datetime.now()
+    for dataset, docs in (("crime", list(crime_docs(crimes, now))), ("collisions", list(collision_docs(collisions, now)))):
+        for index in db.INDEXES:
+            collection = database["{}_{}".format(dataset, index)]
+            collection.drop()
+            for i in range(0, len(docs), batch_size):
+                collection.insert_many([dict(doc) for doc in docs[i:i + batch_size]], ordered=False)
+            db.create_indexes(collection, dataset, index)
+            print("seeded {} ({} docs)".format(collection.name, len(docs)))
+
+def examined(explain):
+    keys = docs = 0
+    stack = [explain]
+    while stack:
+        x = stack.pop()
+        if isinstance(x, dict):
+            keys += x.get("totalKeysExamined", 0)
+            docs += x.get("totalDocsExamined", 0)
+            stack.extend(x.values())
+        elif isinstance(x, list):
+            stack.extend(x)
+    return keys, docs
+
+def run(database, index, points, limit):
+    timings = []
+    keys = docs = matched = 0
+    for lat, lng in points:
+        for dataset, build in (("crime", data.crime_pipelines), ("collisions", data.collision_pipelines)):
+            name = "{}_{}".format(dataset, index)
+            pipelines = build(lat, lng, limit, index)
+            start = time.time()
+            out = data.run_facets(database[name], pipelines)
+            timings.append(time.time() - start)
+            matched += sum(x["count"] for x in out["by_band"])
+            for pipeline in pipelines:
+                explain = database.command({ "explain": { "aggregate": name, "pipeline": pipeline, "cursor": {} }, "verbosity": "executionStats" })
+                k, d = examined(explain)
+                keys += k
+                docs += d
+    print("{:>9}: p50 {:7.1f} ms  p95 {:7.1f} ms  keys/query {:9.0f}  docs/query {:9.0f}  hit rate {:6.1%}".format(
+        index, metrics.percentile(timings, 50) * 1000, metrics.percentile(timings, 95) * 1000,
+        keys / len(timings), docs / len(timings), matched / docs if docs else 1.0))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark 2d vs 2dsphere incident queries.")
+    parser.add_argument("--database", default="homie_bench")
+    parser.add_argument("--crimes", type=int, default=1000000)
+    parser.add_argument("--collisions", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--no-seed", action="store_true", help="reuse data from a previous run")
+    args = parser.parse_args()
+
+    database = db.get_client()[args.database]
+    if not args.no_seed:
+        seed(database, args.crimes, args.collisions, args.batch_size)
+    points = [tuple(reversed(random_point())) for _ in range(args.queries)]
+    for index in db.INDEXES:
+        run(database, index, points, args.limit)
+    db.close()
+
+if __name__ == "__main__":
+    main()
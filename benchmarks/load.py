@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+# End-to-end load test. Serves the Flask app in-process against the upstream
+# stand-ins in fakes.py and drives /info (or /api/info) at fixed concurrency
+# levels, reporting latency percentiles and throughput for each. Incidents
+# come from a synthetic in-process store, or with --store mongo from a seeded
+# scratch database (homie_bench by default), never the live collections.
+#
+#   python benchmarks/load.py --concurrency 1,8,32 --requests 300 --latency 80
+#
+# Caches start empty and stay in memory. Every request is for a new address
+# unless --addresses caps how many distinct ones there are.
+
+import argparse
+import collections
+import datetime
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import config
+import fakes
+import metrics
+
+STREETS = ["N Broad St", "Germantown Ave", "N 5th St", "W Lehigh Ave", "Kensington Ave", "Frankford Ave", "Spring Garden St",
+           "Walnut St", "Chestnut St", "S 9th St", "Passyunk Ave", "Baltimore Ave", "Ridge Ave", "N Fairhill St", "Castor Ave"]
+ZIPCODES = ["19104", "19107", "19122", "19123", "19125", "19130", "19133", "19134", "19139", "19140", "19143", "19147"]
+
+def addresses(n, seed=0):
+    rng = random.Random(seed)
+    seen = set()
+    while len(seen) < n:
+        address = "{} {}, Philadelphia, PA {}".format(rng.randint(100, 9999), rng.choice(STREETS), rng.choice(ZIPCODES))
+        if address not in seen:
+            seen.add(address)
+            yield address
+
+def seed_local(path, crimes, collisions):
+    import density
+    import geo_index
+    import spatial
+    # Whole seconds, like the imported data.
+    now = datetime.datetime.now().replace(microsecond=0)
+    crime, types = spatial.crime_columns(geo_index.crime_docs(crimes, now))
+    spatial.write(os.path.join(path, "spatial", "crime"), crime, config.SPATIAL_CELL_DEG, types)
+    collision = spatial.collision_columns(geo_index.collision_docs(collisions, now))
+    spatial.write(os.path.join(path, "spatial", "collisions"), collision, config.SPATIAL_CELL_DEG)
+
+    # The density grid, grouped here the way density.build groups in Mongo.
+    cell = config.DENSITY_CELL_DEG
+    months = np.concatenate([crime["time"].astype("datetime64[ms]").astype("datetime64[M]").astype(np.int64) + 1970 * 12,
+                             collision["year"].astype(np.int64) * 12 + collision["month"] - 1])
+    kinds = np.concatenate([crime["type"], np.full(len(collision["lat"]), len(types))])
+    keys = np.stack([np.floor(np.concatenate([crime["lat"], collision["lat"]]) / cell).astype(np.int64),
+                     np.floor(np.concatenate([crime["lng"], collision["lng"]]) / cell).astype(np.int64), months, kinds], axis=1)
+    groups, counts = np.unique(keys, axis=0, return_counts=True)
+    density.write(os.path.join(path, "density"), cell, groups[:, 0], groups[:, 1], groups[:, 2], groups[:, 3], counts, types + [density.COLLISION_TYPE])
+    config.SPATIAL_DIR = os.path.join(path, "spatial")
+    config.DENSITY_DIR = os.path.join(path, "density")
+    config.INCIDENT_BACKEND = "local"
+
+def seed_mongo(path, database, crimes, collisions, batch_size=10000):
+    import db
+    import density
+    import geo_index
+    config.MONGO_DB = database
+    if crimes or collisions:
+        now = datetime.datetime.now().replace(microsecond=0)
+        for dataset, docs in (("crime", geo_index.crime_docs(crimes, now)), ("collisions", geo_index.collision_docs(collisions, now))):
+            collection = db.get_db()[dataset]
+            collection.drop()
+            docs = list(docs)
+            for i in range(0, len(docs), batch_size):
+                collection.insert_many(docs[i:i + batch_size], ordered=False)
+            db.create_indexes(collection, dataset)
+            print("seeded {}.{} ({} docs)".format(database, dataset, len(docs)), file=sys.stderr)
+    density.build(os.path.join(path, "density"), config.DENSITY_CELL_DEG)
+    config.DENSITY_DIR = os.path.join(path, "density")
+    config.INCIDENT_BACKEND = "mongo"
+
+class Level(object):
+
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.latency = []
+        self.statuses = collections.Counter()
+        self.degraded = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds, status, degraded=False):
+        with self._lock:
+            self.latency.append(seconds)
+            self.statuses[status] += 1
+            self.degraded += degraded
+
+    @property
+    def errors(self):
+        return sum(n for status, n in self.statuses.items() if status != 200)
+
+# Sends `count` requests, `concurrency` at a time, each for the next address.
+def run_level(base, endpoint, concurrency, count, next_address):
+    level = Level(concurrency)
+    remaining = [count]
+    lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+                address = next_address()
+            start = time.time()
+            try:
+                # progressive=0: the whole report, not just the page shell.
+                r = session.get(base + endpoint, params={ "query": address, "progressive": "0" }, allow_redirects=False, timeout=60)
+                degraded = endpoint == "/api/info" and r.status_code == 200 and bool(r.json().get("unavailable"))
+                level.add(time.time() - start, r.status_code, degraded)
+            except requests.RequestException as e:
+                level.add(time.time() - start, type(e).__name__)
+        session.close()
+
+    start = time.time()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    level.elapsed = time.time() - start
+    return level
+
+def print_level(level, header=False):
+    if header:
+        print("{:>11} {:>8} {:>7} {:>8} {:>8} {:>8} {:>8} {:>8}".format("concurrency", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+    n = len(level.latency)
+    print("{:>11} {:>8} {:>7} {:>8.1f} {:>8.0f} {:>8.0f} {:>8.0f} {:>8.0f}".format(
+        level.concurrency, n, level.errors, n / max(level.elapsed, 1e-9), metrics.percentile(level.latency, 50) * 1000,
+        metrics.percentile(level.latency, 95) * 1000, metrics.percentile(level.latency, 99) * 1000, max(level.latency or [0]) * 1000))
+    sys.stdout.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the app against local upstream stand-ins.")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated client counts, one run each (default: %(default)s)")
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level (default: %(default)s)")
+    parser.add_argument("--addresses", type=int, default=0, help="distinct addresses to cycle through (default: a new one per request)")
+    parser.add_argument("--endpoint", choices=["/info", "/api/info"], default="/info")
+    parser.add_argument("--no-report-cache", action="store_true", help="turn off the per-section report cache")
+    parser.add_argument("--store", choices=["local", "mongo"], default="local", help="where incidents come from (default: %(default)s)")
+    parser.add_argument("--database", default="homie_bench", help="scratch database for --store mongo (default: %(default)s)")
+    parser.add_argument("--crimes", type=int, default=200000)
+    parser.add_argument("--collisions", type=int, default=40000)
+    parser.add_argument("--no-seed", action="store_true", help="with --store mongo, reuse data from a previous run")
+    parser.add_argument("--no-rate-limits", action="store_true", help="don't apply the configured upstream rate limits to the stand-ins")
+    parser.add_argument("--slow-log", action="store_true", help="keep logging slow requests with their spans")
+    parser.add_argument("--max-p95", type=float, help="exit 1 if any level's p95 (ms) is above this")
+    parser.add_argument("--max-errors", type=float, help="exit 1 if any level's error share is above this")
+    fakes.add_arguments(parser)
+    args = parser.parse_args()
+    levels = [int(x) for x in args.concurrency.split(",")]
+
+    # Everything that reads config at import time is imported below, once the
+    # settings are in place.
+    for name in dir(config):
+        if name.endswith("_CACHE_PATH"):
+            setattr(config, name, None)
+    config.REPORT_CACHE = not args.no_report_cache
+    if not args.slow_log:
+        config.SLOW_REQUEST_SECONDS = float("inf")
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    servers = fakes.start(fakes.faults_from_args(args))
+    fakes.redirect(config, servers, rate_limits=not args.no_rate_limits)
+    scratch = tempfile.mkdtemp(prefix="homie-load-")
+    try:
+        if args.store == "local":
+            seed_local(scratch, args.crimes, args.collisions)
+        else:
+            seed_mongo(scratch, args.database, 0 if args.no_seed else args.crimes, 0 if args.no_seed else args.collisions)
+
+        from werkzeug.serving import make_server
+        import server
+        app = make_server("127.0.0.1", 0, server.app, threaded=True)
+        thread = threading.Thread(target=app.serve_forever)
+        thread.daemon = True
+        thread.start()
+        base = "http://127.0.0.1:{}".format(app.server_port)
+
+        total = args.requests * len(levels)
+        pool = list(addresses(args.addresses or total))
+        cursor = [0]
+        cursor_lock = threading.Lock()
+
+        def next_address():
+            with cursor_lock:
+                cursor[0] += 1
+                return pool[(cursor[0] - 1) % len(pool)]
+
+        failed = False
+        for i, concurrency in enumerate(levels):
+            level = run_level(base, args.endpoint, concurrency, args.requests, next_address)
+            print_level(level, header=i == 0)
+            if args.max_p95 is not None and metrics.percentile(level.latency, 95) * 1000 > args.max_p95:
+                failed = True
+            if args.max_errors is not None and level.errors / float(max(len(level.latency), 1)) > args.max_errors:
+                failed = True
+            if level.degraded:
+                print("  {} responses had unavailable sections".format(level.degraded), file=sys.stderr)
+            other = { str(k): n for k, n in level.statuses.items() if k != 200 }
+            if other:
+                print("  non-200 responses: {}".format(other), file=sys.stderr)
+        print("upstream requests: {}".format(", ".join("{} {}".format(name, s.requests) for name, s in sorted(servers.items()))), file=sys.stderr)
+        app.shutdown()
+    finally:
+        fakes.stop(servers)
+        shutil.rmtree(scratch, ignore_errors=True)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
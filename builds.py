@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# The data built offline and read in place (spatial.py, density.py,
+# keystone.py). A build is written to a scratch directory and swapped in
+# whole; readers notice it by its meta.json's mtime and reload, while
+# processes still mapping the old files keep reading them until then.
+
+import contextlib
+import os
+import shutil
+import threading
+import time
+
+# Yields a scratch directory to build into, and swaps it in for `out` once
+# the block completes.
+@contextlib.contextmanager
+def swap(out):
+    tmp = out + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    yield tmp
+    old = out + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(out):
+        os.rename(out, old)
+    os.rename(tmp, out)
+    shutil.rmtree(old, ignore_errors=True)
+
+# When `path` was last built: the mtime of a build directory's meta.json, or
+# of a plain file. None if there is none.
+def built(path):
+    try:
+        return os.stat(os.path.join(path, "meta.json") if os.path.isdir(path) else path).st_mtime
+    except FileNotFoundError:
+        return None
+
+# Builds loaded with `load(path)`, each checked for a rebuild at most every
+# `interval()` seconds. get() returns None for a path never built; a path
+# that goes missing after loading (mid-swap) keeps its last load.
+class Loaded(object):
+
+    def __init__(self, load, interval):
+        self.load = load
+        self.interval = interval
+        self._lock = threading.Lock()
+        # Path -> (value, built, last checked).
+        self._entries = {}
+
+    def get(self, path):
+        entry = self._entries.get(path)
+        if entry is None or time.time() - entry[2] > self.interval():
+            with self._lock:
+                entry = self._entries.get(path)
+                if entry is None or time.time() - entry[2] > self.interval():
+                    mtime = built(path)
+                    if entry is None or (mtime is not None and mtime != entry[1]):
+                        if mtime is None:
+                            print("no build in {}".format(path))
+                        entry = (self.load(path) if mtime is not None else None, mtime, time.time())
+                    else:
+                        entry = (entry[0], entry[1], time.time())
+                    self._entries[path] = entry
+        return entry[0]
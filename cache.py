@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+# Shared caching building blocks: a bounded in-memory LRU, an optional SQLite
+# tier that persists across restarts and is shared by every process on the
+# host, Cache, which layers the two with TTLs and hit/miss counters, and
+# SingleFlight, which keeps concurrent misses from fetching the same thing.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+# Every Cache by name, for reporting.
+caches = {}
+
+# How often (seconds) a disk tier purges long-expired rows as it's written to.
+PURGE_INTERVAL = 3600
+
+class LRUCache(object):
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Returns (value, expires), or (MISSING, None).
+    def lookup(self, key):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+                return self._data[key]
+            except KeyError:
+                return MISSING, None
+
+    def set(self, key, value, expires):
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+# Rows that expired more than `retain` seconds ago (never, if None) are
+# purged when the store is opened and every PURGE_INTERVAL seconds after.
+class SQLiteStore(object):
+
+    def __init__(self, path, table, retain=None):
+        self.path = path
+        self.table = table
+        self.retain = retain
+        self._local = threading.local()
+        self._purged = 0
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS {} (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)".format(table))
+        self._purge_expired()
+
+    # sqlite3 connections can't cross threads or forks, so each thread of each
+    # process opens its own.
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def lookup(self, key):
+        row = self._conn().execute("SELECT value, expires FROM {} WHERE key = ?".format(self.table), (key,)).fetchone()
+        if row is None:
+            return MISSING, None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, expires):
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO {} (key, value, expires) VALUES (?, ?, ?)".format(self.table), (key, json.dumps(value), expires))
+        if time.time() - self._purged > PURGE_INTERVAL:
+            self._purge_expired()
+
+    def pop(self, key):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM {} WHERE key = ?".format(self.table), (key,))
+
+    def clear(self):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM {}".format(self.table))
+
+    def purge(self, before=None):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM {} WHERE expires < ?".format(self.table), (before or time.time(),))
+
+    def _purge_expired(self):
+        self._purged = time.time()
+        if self.retain is not None:
+            self.purge(self._purged - self.retain)
+
+# `retain` is how long expired entries are kept on disk for stale reads.
+class Cache(object):
+
+    def __init__(self, name, maxsize, ttl, path=None, retain=None):
+        self.name = name
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize)
+        self.disk = SQLiteStore(path, name, retain) if path else None
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        caches[name] = self
+
+    # Returns the cached value, or MISSING if there is none or it has expired.
+    # stale=True also returns expired values.
+    def get(self, key, stale=False):
+        return self.lookup(key, None if stale else 0)[0]
+
+    # Returns (value, fresh). Values that expired more than `max_stale`
+    # seconds ago (ever, if None) come back as MISSING.
+    def lookup(self, key, max_stale=None):
+        now = time.time()
+        value, expires = self.memory.lookup(key)
+        # Another process may have refreshed the disk tier since this one
+        # last looked.
+        if self.disk is not None and (value is MISSING or (expires is not None and expires < now)):
+            disk_value, disk_expires = self.disk.lookup(key)
+            if disk_value is not MISSING:
+                value, expires = disk_value, disk_expires
+                self.memory.set(key, value, expires)
+        fresh = expires is None or expires >= now
+        if value is MISSING or (not fresh and max_stale is not None and now - expires >= max_stale):
+            with self._lock:
+                self.misses += 1
+            return MISSING, False
+        with self._lock:
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale += 1
+        return value, fresh
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl is not None else None
+        self.memory.set(key, value, expires)
+        if self.disk is not None:
+            self.disk.set(key, value, expires)
+
+    def pop(self, key):
+        self.memory.pop(key)
+        if self.disk is not None:
+            self.disk.pop(key)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        return { "hits": self.hits, "stale": self.stale, "misses": self.misses, "size": len(self.memory) }
+
+# Collapses concurrent calls for the same key into one: the first caller runs
+# fn and everyone who arrives while it is running gets its result (or its
+# exception).
+class SingleFlight(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = { "done": threading.Event() }
+        if not leader:
+            call["done"].wait()
+            if "error" in call:
+                raise call["error"]
+            return call["value"]
+        try:
+            call["value"] = fn()
+            return call["value"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
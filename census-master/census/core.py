@@ -1,11 +1,17 @@
 import json
 import warnings
+from collections import OrderedDict
 from functools import wraps
+from multiprocessing.pool import ThreadPool
 
 __version__ = "0.8.1"
 
 ALL = '*'
 ENDPOINT_URL = 'http://api.census.gov/data/%s/%s'
+# The API returns at most this many variables per call; Client.get splits
+# longer field lists into several calls made MAX_WORKERS at a time.
+MAX_FIELDS = 50
+MAX_WORKERS = 4
 DEFINITIONS = {
     'acs5': {
         '2014': 'http://api.census.gov/data/2014/acs5/variables.json',
@@ -53,6 +59,26 @@ def list_or_str(v):
     return [v]
 
 
+def chunks(v, n):
+    """ Split a list into lists of at most n items.
+    """
+    return [v[i:i + n] for i in range(0, len(v), n)]
+
+
+def merge(results, fields):
+    """ Join the rows of several calls for the same geography on the
+        geography columns (every column that isn't a requested field).
+    """
+    fields = set(fields)
+    rows = OrderedDict()
+    for result in results:
+        for row in result:
+            key = tuple(sorted((k, v) for k, v in row.items()
+                               if k not in fields))
+            rows.setdefault(key, {}).update(row)
+    return list(rows.values())
+
+
 def supported_years(*years):
     def inner(func):
         @wraps(func)
@@ -121,14 +147,26 @@ class Client(object):
 
     def get(self, fields, geo, year=None, **kwargs):
 
-        if len(fields) > 50:
-            raise CensusException("only 50 columns per call are allowed")
+        fields = list_or_str(fields)
+
+        if len(fields) <= MAX_FIELDS:
+            return self._get(fields, geo, year)
+
+        parts = chunks(list(fields), MAX_FIELDS)
+        pool = ThreadPool(min(MAX_WORKERS, len(parts)))
+        try:
+            results = pool.map(lambda part: self._get(part, geo, year), parts)
+        finally:
+            pool.close()
+            pool.join()
+
+        return merge(results, fields)
+
+    def _get(self, fields, geo, year=None):
 
         if year is None:
             year = self.default_year
 
-        fields = list_or_str(fields)
-
         url = ENDPOINT_URL % (year, self.dataset)
 
         params = {
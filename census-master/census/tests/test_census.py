@@ -1,4 +1,6 @@
+import json
 import os
+import threading
 import time
 import unittest
 from contextlib import closing
@@ -6,7 +8,7 @@ from contextlib import closing
 import requests
 
 from census.core import (
-    Census, UnsupportedYearException, DEFINITIONS, __version__)
+    Census, UnsupportedYearException, DEFINITIONS, MAX_FIELDS, __version__)
 
 KEY = os.environ.get('CENSUS_KEY', '')
 
@@ -206,5 +208,69 @@ class TestEndpoints(CensusTestCase):
         self.check_endpoints('sf3', tests)
 
 
+class FakeResponse(object):
+
+    status_code = 200
+
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeSession(object):
+    """ Answers every call with two counties, each value naming its field
+        and county.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get(self, url, params=None, headers=None):
+        fields = params['get'].split(',')
+        with self.lock:
+            self.calls.append(fields)
+        rows = [fields + ['state', 'county']]
+        for county in ('003', '001'):
+            rows.append(['{}:{}'.format(f, county) for f in fields] +
+                        ['24', county])
+        return FakeResponse(json.dumps(rows))
+
+    def close(self):
+        pass
+
+
+class TestChunking(unittest.TestCase):
+
+    def setUp(self):
+        self.session = FakeSession()
+        self.client = Census(KEY, session=self.session).acs5
+
+    def test_many_fields(self):
+
+        fields = ['B01001_{:03d}E'.format(i) for i in range(1, 121)]
+        data = self.client.state_county(fields, '24', '*')
+
+        self.assertEqual(len(self.session.calls), 3)
+        for call in self.session.calls:
+            self.assertTrue(len(call) <= MAX_FIELDS)
+        self.assertEqual(sorted(sum(self.session.calls, [])), sorted(fields))
+
+        self.assertEqual([row['county'] for row in data], ['003', '001'])
+        for row in data:
+            self.assertEqual(row['state'], '24')
+            for field in fields:
+                self.assertEqual(row[field],
+                                 '{}:{}'.format(field, row['county']))
+
+    def test_single_field(self):
+
+        # A lone field is one column, however long its name.
+        field = 'B' * (MAX_FIELDS + 10)
+        data = self.client.state_county(field, '24', '*')
+
+        self.assertEqual(self.session.calls, [[field]])
+        self.assertEqual(data[0][field], '{}:003'.format(field))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,163 @@
+# Tunables that are safe to commit. API keys and credentials live in secret.py.
+
+# /info section fan-out
+CONCURRENT_SECTIONS = True
+SECTION_WORKERS = 32
+# Seconds a page waits for each section; None waits as long as it takes.
+SECTION_TIMEOUT = 8.0
+SECTION_TIMEOUTS = {
+    "overview": 6.0,
+    "schools": 6.0,
+    "crimes": 5.0,
+}
+
+# Render /info as a shell right away and let info.js fetch each section from
+# /info/section/<name> as it's ready. Off (or ?progressive=0) renders the
+# whole page at once.
+PROGRESSIVE_INFO = True
+
+# Report cache (report.py): each section of a report, keyed by place_id.
+# Sections past their TTL are still served, for up to REPORT_MAX_STALE more
+# seconds, while a background refresh runs.
+REPORT_CACHE = True
+REPORT_CACHE_SIZE = 20000
+REPORT_CACHE_PATH = "cache/report.sqlite3"
+REPORT_TTL = 86400
+REPORT_TTLS = {
+    "overview": 6 * 3600,
+    "crimes": 3600,
+    "safety": 6 * 3600,
+    "schools": 7 * 86400,
+}
+REPORT_MAX_STALE = 7 * 86400
+REPORT_REFRESH_WORKERS = 4
+
+# JSON API (/api/info/batch)
+API_BATCH_LIMIT = 500
+# Places built at once per batch request.
+API_BATCH_WORKERS = 8
+# Fewest places still needing incidents for a batch to load them with one
+# query over the union of their areas; below it each place's own aggregates
+# are cheaper.
+API_BATCH_AREA_MIN_PLACES = 8
+
+# Upstream base URLs. benchmarks/load.py points these at local stand-ins.
+GOOGLE_MAPS_URL = "https://maps.googleapis.com"
+ZILLOW_URL = "https://www.zillow.com"
+SCHOOL_FINDER_URL = "https://webapps.philasd.org"
+CENSUS_GEOCODER_URL = "https://geocoding.geo.census.gov"
+
+# Upstream HTTP client (upstream.py)
+UPSTREAM_CONNECT_TIMEOUT = 3.05
+UPSTREAM_READ_TIMEOUT = 10.0
+UPSTREAM_RETRIES = 2
+UPSTREAM_BACKOFF = 0.25
+UPSTREAM_BACKOFF_MAX = 2.0
+# Max concurrent requests (and pooled keep-alive connections) per host.
+UPSTREAM_DEFAULT_LIMIT = 8
+UPSTREAM_HOST_LIMITS = {
+    "maps.googleapis.com": 32,
+    "www.zillow.com": 8,
+    "webapps.philasd.org": 4,
+}
+# How long a request may wait for a free per-host slot or a rate-limit token
+# before giving up; None waits as long as it takes.
+UPSTREAM_QUEUE_TIMEOUT = 5.0
+# Optional request-rate caps per host: (requests per second, burst). Hosts not
+# listed are only limited by concurrency. batch.py --rate overrides these.
+UPSTREAM_RATE_LIMITS = {}
+# Rate caps for each API key used with a host (the "key" or "zws-id"
+# parameter). Like all of these limits they apply per process, so divide the
+# provider's quota by the number of worker processes.
+UPSTREAM_KEY_RATE_LIMITS = {
+    "maps.googleapis.com": (50.0, 100),
+    "www.zillow.com": (5.0, 10),
+}
+# Consecutive failures (timeouts, 5xx, quota errors) after which a host's
+# circuit breaker opens, and how long (seconds) it stays open.
+UPSTREAM_BREAKER_FAILURES = 5
+UPSTREAM_BREAKER_COOLDOWN = 30.0
+# Send identical concurrent requests only once.
+UPSTREAM_DEDUPE = True
+
+# MongoDB (db.py)
+MONGO_DB = "homie"
+MONGO_POOL_SIZE = 50
+MONGO_MIN_POOL_SIZE = 0
+MONGO_SERVER_SELECTION_TIMEOUT_MS = 5000
+MONGO_CONNECT_TIMEOUT_MS = 5000
+MONGO_SOCKET_TIMEOUT_MS = 10000
+MONGO_WAIT_QUEUE_TIMEOUT_MS = 5000
+MONGO_BATCH_SIZE = 1000
+# Geo index the incident queries use: "2d" (legacy [lng, lat] pairs in coord)
+# or "2dsphere" (GeoJSON points in loc, added by migrate_geo.py).
+GEO_INDEX = "2d"
+
+# Worker pool data.py uses for concurrent queries within one section
+DATA_WORKERS = 16
+
+# Where get_crimes/get_collisions read from: "mongo", or "local" for the
+# memory-mapped arrays built by `python spatial.py build`.
+INCIDENT_BACKEND = "mongo"
+SPATIAL_DIR = "spatialdata"
+# How often (seconds) to check SPATIAL_DIR and DENSITY_DIR for a rebuild.
+SPATIAL_CHECK_INTERVAL = 30
+DENSITY_CHECK_INTERVAL = 30
+# Grid cell size (degrees) of the local backend's spatial index.
+SPATIAL_CELL_DEG = 0.02
+# Largest radius (miles) one batch-wide incident query may cover; batches
+# spread wider query each place on its own.
+INCIDENT_AREA_MAX_MILES = 15
+
+# Precomputed density grid (`python density.py build`) behind the safety
+# summary on /info
+DENSITY_DIR = "densitydata"
+DENSITY_CELL_DEG = 0.005
+SAFETY_RADIUS = 1
+SAFETY_MONTHS = 12
+
+# Expired entries stay in the caches' disk tiers this much longer (seconds),
+# to be served while an upstream is down; older ones are purged.
+CACHE_STALE_RETAIN = 30 * 86400
+
+# Geocode cache: in-memory LRU in front of a SQLite file shared by all workers
+GEOCODE_CACHE_SIZE = 10000
+GEOCODE_CACHE_PATH = "cache/geocode.sqlite3"
+GEOCODE_TTL = 30 * 86400
+GEOCODE_NEGATIVE_TTL = 86400
+
+# Places nearby-search cache. Precision-7 geohash cells are about 150 m across.
+NEARBY_CELL_PRECISION = 7
+NEARBY_CACHE_SIZE = 20000
+NEARBY_TTL = 7 * 86400
+# Set to a path (e.g. "cache/nearby.sqlite3") to add a disk tier.
+NEARBY_CACHE_PATH = None
+
+# Zillow property cache. Facts like sqft and yearBuilt change rarely; the
+# zestimate and its 30-day change are refreshed daily.
+ZILLOW_CACHE_SIZE = 10000
+ZILLOW_CACHE_PATH = "cache/zillow.sqlite3"
+ZILLOW_STATIC_TTL = 30 * 86400
+ZILLOW_VOLATILE_TTL = 86400
+ZILLOW_ADVANCED_TTL = 7 * 86400
+ZILLOW_NEGATIVE_TTL = 86400
+
+# Keystone exam results (keystone.py). The columnar build in KEYSTONE_DIR
+# (`python keystone.py build`) is used when present, else the legacy JSON.
+KEYSTONE_DIR = "keystonedata"
+KEYSTONE_PATH = "jsondata/keystone.json"
+KEYSTONE_DISTRICT = "PHILADELPHIA CITY SD"
+# How often (seconds) to check the data file for changes.
+KEYSTONE_CHECK_INTERVAL = 30
+
+# School-finder cache (data.get_schools). Assignments are cached per geohash
+# cell (precision 8 is about 38 x 19 m) until the school year rolls over.
+SCHOOL_CELL_PRECISION = 8
+SCHOOL_CACHE_SIZE = 20000
+SCHOOL_CACHE_PATH = "cache/schools.sqlite3"
+# (month, day) on which the new school year's catchments take effect.
+SCHOOL_YEAR_ROLLOVER = (7, 1)
+
+# Metrics (metrics.py). Requests slower than this (seconds) are logged with a
+# breakdown of where the time went.
+SLOW_REQUEST_SECONDS = 3.0
@@ -1,52 +1,189 @@
 #!/usr/bin/env python3
 
-import requests
+import upstream
+import io
 import json
-import pymongo
+import re
+import db
 import datetime
+import cache
+import config
+import spatial
+import density
+import keystone
+import metrics
+from geo import EARTH_RADIUS, SPHERE_RADIUS, METERS_PER_MILE, haversine_many, geohash
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import xml.etree.ElementTree as ET
-from secret import ZWSID, GMAPS_API_KEY, DB_URL
-from math import radians, cos, sin, asin, sqrt, pi
-import ast
-from bs4 import BeautifulSoup
-
-def get_mongo_client():
-    return pymongo.MongoClient(DB_URL)
-
-def get_crimes(lat, lng):
-    client = get_mongo_client()
-    out = client.homie.crime.aggregate([
-        { "$geoNear": { "near": [lng, lat], "distanceField": "distance", "maxDistance": 10/3959, "spherical": True } },
-        { "$match": { "time" : { "$gt": datetime.datetime.now() - datetime.timedelta(days=3*365) } } }
-    ])
-    client.close()
-    return [{ "coord": x["coord"], "type": x["type"], "time": x["time"].isoformat(), "dist": x["distance"]*3959 } for x in out]
+from secret import ZWSID, GMAPS_API_KEY
+import html
 
-def get_crimes_and_collisions(lat, lng):
-    out = get_crimes(lat, lng)[:5]
-    for x in get_collisions(lat, lng)[:5]:
+INCIDENT_RADIUS = 10
+# Lower bounds (miles) of the distance bands incidents are counted in.
+RADIUS_BANDS = [0, 0.5, 1, 2, 5]
+
+_executor = ThreadPoolExecutor(max_workers=config.DATA_WORKERS)
+
+def crime_since():
+    return datetime.datetime.now() - datetime.timedelta(days=3*365)
+
+def collision_after_year():
+    return datetime.datetime.now().year - 3
+
+def crime_match():
+    return { "time" : { "$gt": crime_since() } }
+
+def collision_match():
+    return { "year": { "$gt": collision_after_year() } }
+
+# $geoNear stages that emit matching documents nearest first with "distance"
+# in miles. The date cut runs inside $geoNear, so with the 2dsphere index the
+# compound geo+time index does it. Before MongoDB 4.2 $geoNear stops at 100
+# documents, so only the nearest few rows come from here; the counts come
+# from counts_pipeline.
+def incident_stages(lat, lng, match, index=None):
+    if (index or config.GEO_INDEX) == "2dsphere":
+        return [{ "$geoNear": { "near": { "type": "Point", "coordinates": [lng, lat] }, "key": "loc", "distanceField": "distance", "distanceMultiplier": 1/METERS_PER_MILE, "maxDistance": INCIDENT_RADIUS*METERS_PER_MILE, "query": match, "spherical": True } }]
+    return [{ "$geoNear": { "near": [lng, lat], "key": "coord", "distanceField": "distance", "distanceMultiplier": EARTH_RADIUS, "maxDistance": INCIDENT_RADIUS/EARTH_RADIUS, "query": match, "spherical": True } }]
+
+# Documents within `miles`, measured the way the index's $geoNear measures.
+def within(lat, lng, miles, index=None):
+    if (index or config.GEO_INDEX) == "2dsphere":
+        return { "loc": { "$geoWithin": { "$centerSphere": [[lng, lat], miles / SPHERE_RADIUS] } } }
+    return { "coord": { "$geoWithin": { "$centerSphere": [[lng, lat], miles / EARTH_RADIUS] } } }
+
+# One aggregate counting every match within INCIDENT_RADIUS, uncapped: the
+# given facets plus "within_<i>", the count inside each band's outer edge.
+def counts_pipeline(lat, lng, match, facets=None, index=None):
+    edges = RADIUS_BANDS[1:] + [INCIDENT_RADIUS]
+    out = dict(facets or {})
+    for i, miles in enumerate(edges):
+        out["within_{}".format(i)] = ([] if miles == INCIDENT_RADIUS else [{ "$match": within(lat, lng, miles, index) }]) + [{ "$count": "count" }]
+    return [{ "$match": dict(within(lat, lng, INCIDENT_RADIUS, index), **match) }, { "$facet": out }]
+
+# Per-band counts ({ "_id": lower bound, "count": n }) from counts_pipeline.
+def band_counts(out):
+    totals = [0] + [out["within_{}".format(i)][0]["count"] if out["within_{}".format(i)] else 0 for i in range(len(RADIUS_BANDS))]
+    return [{ "_id": b, "count": totals[i + 1] - totals[i] } for i, b in enumerate(RADIUS_BANDS) if totals[i + 1] > totals[i]]
+
+CRIME_FIELDS = { "_id": 0, "coord": 1, "type": 1, "time": 1, "distance": 1 }
+COLLISION_FIELDS = { "_id": 0, "coord": 1, "year": 1, "month": 1, "distance": 1 }
+
+def crime_row(x):
+    return { "coord": x["coord"], "type": x["type"], "time": x["time"].isoformat(), "dist": x["distance"] }
+
+def collision_row(x):
+    return { "coord": x["coord"], "year": x["year"], "month": x["month"], "dist": x["distance"] }
+
+def rows_pipeline(lat, lng, match, fields, limit, index=None):
+    pipeline = incident_stages(lat, lng, match, index)
+    if limit is not None:
+        pipeline.append({ "$limit": limit })
+    pipeline.append({ "$project": fields })
+    return pipeline
+
+def get_crimes(lat, lng, limit=None):
+    if config.INCIDENT_BACKEND == "local":
+        return [crime_row(x) for x in _crime_facets(lat, lng, limit)["rows"]]
+    out = db.get_db().crime.aggregate(rows_pipeline(lat, lng, crime_match(), CRIME_FIELDS, limit), batchSize=config.MONGO_BATCH_SIZE)
+    return [crime_row(x) for x in out]
+
+def get_collisions(lat, lng, limit=None):
+    if config.INCIDENT_BACKEND == "local":
+        return [collision_row(x) for x in _collision_facets(lat, lng, limit)["rows"]]
+    out = db.get_db().collisions.aggregate(rows_pipeline(lat, lng, collision_match(), COLLISION_FIELDS, limit), batchSize=config.MONGO_BATCH_SIZE)
+    return [collision_row(x) for x in out]
+
+# The (rows, counts) aggregates per collection: the nearest `limit` rows, and
+# counts by type and distance band, all computed server-side.
+def crime_pipelines(lat, lng, limit, index=None):
+    match = crime_match()
+    return rows_pipeline(lat, lng, match, CRIME_FIELDS, limit, index), \
+           counts_pipeline(lat, lng, match, { "by_type": [{ "$group": { "_id": "$type", "count": { "$sum": 1 } } }, { "$sort": { "count": -1 } }] }, index)
+
+def collision_pipelines(lat, lng, limit, index=None):
+    match = collision_match()
+    return rows_pipeline(lat, lng, match, COLLISION_FIELDS, limit, index), counts_pipeline(lat, lng, match, index=index)
+
+# Runs a (rows, counts) pair into the shape spatial.crime_facets returns.
+def run_facets(collection, pipelines):
+    rows, counts = pipelines
+    out = next(collection.aggregate(counts))
+    return { "rows": list(collection.aggregate(rows)), "by_type": out.get("by_type", []), "by_band": band_counts(out) }
+
+def _crime_facets(lat, lng, limit, area=None):
+    if area is not None or config.INCIDENT_BACKEND == "local":
+        return spatial.crime_facets(lat, lng, limit, INCIDENT_RADIUS, crime_since(), RADIUS_BANDS, area and area["crime"])
+    return run_facets(db.get_db().crime, crime_pipelines(lat, lng, limit))
+
+def _collision_facets(lat, lng, limit, area=None):
+    if area is not None or config.INCIDENT_BACKEND == "local":
+        return spatial.collision_facets(lat, lng, limit, INCIDENT_RADIUS, collision_after_year(), RADIUS_BANDS, area and area["collisions"])
+    return run_facets(db.get_db().collisions, collision_pipelines(lat, lng, limit))
+
+def incident_stats(crime_types, crime_bands, collision_bands):
+    crime_bands = dict(crime_bands)
+    collision_bands = dict(collision_bands)
+    bounds = RADIUS_BANDS + [INCIDENT_RADIUS]
+    return {
+        "radius": INCIDENT_RADIUS,
+        "crimes": sum(crime_bands.values()),
+        "collisions": sum(collision_bands.values()),
+        "by_type": [{ "type": t, "count": c } for t, c in crime_types],
+        "by_band": [{ "min": bounds[i], "max": bounds[i + 1], "crimes": crime_bands.get(bounds[i], 0), "collisions": collision_bands.get(bounds[i], 0) } for i in range(len(RADIUS_BANDS))]
+    }
+
+def merge_incidents(crimes, collisions):
+    out = list(crimes)
+    for x in collisions:
         out.append({ "coord": x["coord"], "type": "Car Accident", "time": datetime.datetime(x["year"], x["month"], 1).isoformat(), "dist": x["dist"], "car": True })
     out.sort(key=lambda k: k["dist"])
     return out
 
-def get_collisions(lat, lng):
-    client = get_mongo_client()
-    out = client.homie.collisions.aggregate([
-        { "$geoNear": { "near": [lng, lat], "distanceField": "distance", "maxDistance": 10/3959, "spherical": True } },
-        { "$match": { "year": { "$gt": datetime.datetime.now().year - 3 } } }
-    ])
-    client.close()
-    return [{ "coord": x["coord"], "year": x["year"], "month": x["month"], "dist": x["distance"]*3959 } for x in out]
-
-def haversine(lon1, lat1, lon2, lat2):
-    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    r = 3959
-    return c * r
+# Loads every incident within INCIDENT_RADIUS of any of `points` with one
+# query per collection into in-memory datasets. Passed to get_incidents as
+# `area`, it answers each point without going back to the database. None with
+# the local backend, which is in-process already, and when the points are too
+# far apart for one query to beat one per point (INCIDENT_AREA_MAX_MILES).
+@metrics.timed("incident_area")
+def incident_area(points):
+    if config.INCIDENT_BACKEND == "local" or not points:
+        return None
+    lats = [p[0] for p in points]
+    lngs = [p[1] for p in points]
+    lat, lng = sum(lats) / len(lats), sum(lngs) / len(lngs)
+    radius = spatial.earth_radius()
+    reach = float(haversine_many(lng, lat, lngs, lats, radius).max()) + INCIDENT_RADIUS
+    if reach > config.INCIDENT_AREA_MAX_MILES:
+        return None
+    near = within(lat, lng, reach)
+    crimes = _executor.submit(metrics.bind(lambda: spatial.crime_columns(db.get_db().crime.find(dict(near, **crime_match()), { "_id": 0, "coord": 1, "type": 1, "time": 1 }, batch_size=config.MONGO_BATCH_SIZE))))
+    collisions = spatial.collision_columns(db.get_db().collisions.find(dict(near, **collision_match()), { "_id": 0, "coord": 1, "year": 1, "month": 1 }, batch_size=config.MONGO_BATCH_SIZE))
+    columns, types = crimes.result()
+    return {
+        "crime": spatial.layout(columns, config.SPATIAL_CELL_DEG, types),
+        "collisions": spatial.layout(collisions, config.SPATIAL_CELL_DEG)
+    }
+
+@metrics.timed("get_incidents")
+def get_incidents(lat, lng, limit=5, area=None):
+    crimes = _executor.submit(metrics.bind(_crime_facets), lat, lng, limit, area)
+    collisions = _collision_facets(lat, lng, limit, area)
+    crimes = crimes.result()
+    return {
+        "recent": merge_incidents([crime_row(x) for x in crimes["rows"]], [collision_row(x) for x in collisions["rows"]]),
+        "stats": incident_stats([(x["_id"], x["count"]) for x in crimes["by_type"]],
+                                [(x["_id"], x["count"]) for x in crimes["by_band"]],
+                                [(x["_id"], x["count"]) for x in collisions["by_band"]])
+    }
+
+def get_crimes_and_collisions(lat, lng):
+    return get_incidents(lat, lng)["recent"]
+
+@metrics.timed("get_safety")
+def get_safety(lat, lng):
+    return density.summary(lat, lng, config.SAFETY_RADIUS, config.SAFETY_MONTHS)
 
 def xml_to_dict(xml):
     out = {}
@@ -57,34 +194,132 @@ def xml_to_dict(xml):
             out[x.tag] = x.text
     return out
 
-# other values: https://developers.google.com/places/supported_types
-def get_nearby(lat, lng, building="bus_station"):
-    r = requests.get("https://maps.googleapis.com/maps/api/place/nearbysearch/json", params = {
-        "key": GMAPS_API_KEY,
-        "rankby": "distance",
-        "location": "{},{}".format(lat, lng),
-        "types": building
-    })
-    out = r.json()
+# Nearby searches are cached per (geohash cell, type set): houses in the same
+# cell share one Places call, with the results re-ranked for the exact point.
+# Concurrent misses for the same cache entry share one upstream call, so a
+# batch of nearby addresses doesn't fetch the same cell many times over.
+_flights = cache.SingleFlight()
+
+_nearby = cache.Cache("nearby", config.NEARBY_CACHE_SIZE, config.NEARBY_TTL, config.NEARBY_CACHE_PATH, config.CACHE_STALE_RETAIN)
+NEARBY_FIELDS = ("name", "types", "geometry", "place_id", "vicinity")
+
+GOOGLE_QUOTA = ("OVER_QUERY_LIMIT", "OVER_DAILY_LIMIT")
+GOOGLE_UNAVAILABLE = ("UNKNOWN_ERROR",)
+
+# Raises for the statuses that say the service itself is in trouble, so they
+# count against its breaker.
+def _google_check(r):
+    status = r.json().get("status")
+    if status in GOOGLE_QUOTA or status in GOOGLE_UNAVAILABLE:
+        raise upstream.api_error(r.url, status, quota=status in GOOGLE_QUOTA, unavailable=status in GOOGLE_UNAVAILABLE)
+
+# Calls a Google Maps web service. ZERO_RESULTS comes back as an empty result
+# list; other statuses raise the matching upstream error.
+def _google(url, params):
+    params["key"] = GMAPS_API_KEY
+    out = upstream.get(url, params=params, check=_google_check).json()
     if out["status"] != "OK":
         if "ZERO_RESULTS" in out["status"]:
             return { "results": [], "status": "OK" }
-        else:
-            raise Exception(out["status"])
+        raise upstream.api_error(url, out["status"])
     return out
 
-def geocode(address):
-    r = requests.get("https://maps.googleapis.com/maps/api/geocode/json", params = {
-        "key": GMAPS_API_KEY,
-        "address": address
+# Runs `fetch` to fill a cache miss; if the upstream is failing (or its
+# breaker is open), serves the expired entry instead when there is one.
+def _or_stale(store, key, fetch):
+    try:
+        return fetch()
+    except upstream.UpstreamError:
+        value = store.get(key, stale=True)
+        if value is cache.MISSING:
+            raise
+        print("{}: serving stale {}".format(store.name, key))
+        return value
+
+def _get_nearby(lat, lng, building):
+    return _google(config.GOOGLE_MAPS_URL + "/maps/api/place/nearbysearch/json", {
+        "rankby": "distance",
+        "location": "{},{}".format(lat, lng),
+        "types": building
     })
-    out = r.json()
-    if out["status"] != "OK":
-        if "ZERO_RESULTS" in out["status"]:
-            return { "results": [], "status": "OK" }
-        else:
-            raise Exception(out["status"])
-        raise Exception(out["status"])
+
+def rank_by_distance(results, lat, lng):
+    if not results:
+        return results
+    dists = haversine_many(lng, lat, [x["geometry"]["location"]["lng"] for x in results],
+                                     [x["geometry"]["location"]["lat"] for x in results])
+    return [results[i] for i in dists.argsort(kind="mergesort")]
+
+def _fill_nearby(key, lat, lng, building):
+    results = [{ k: x[k] for k in NEARBY_FIELDS if k in x } for x in _get_nearby(lat, lng, building)["results"]]
+    _nearby.set(key, results)
+    return results
+
+# other values: https://developers.google.com/places/supported_types
+@metrics.timed("get_nearby")
+def get_nearby(lat, lng, building="bus_station"):
+    key = "{}:{}".format(geohash(lat, lng, config.NEARBY_CELL_PRECISION), "|".join(sorted(building.split("|"))))
+    results = _nearby.get(key)
+    if results is cache.MISSING:
+        results = _or_stale(_nearby, key, lambda: _flights.do("nearby:" + key, lambda: _fill_nearby(key, lat, lng, building)))
+    return { "results": rank_by_distance(results, lat, lng), "status": "OK" }
+
+_geocodes = cache.Cache("geocode", config.GEOCODE_CACHE_SIZE, config.GEOCODE_TTL, config.GEOCODE_CACHE_PATH, config.CACHE_STALE_RETAIN)
+
+ADDRESS_ABBREVIATIONS = {
+    "street": "st", "avenue": "ave", "road": "rd", "boulevard": "blvd", "drive": "dr",
+    "lane": "ln", "court": "ct", "place": "pl", "terrace": "ter", "parkway": "pkwy",
+    "highway": "hwy", "square": "sq", "circle": "cir", "apartment": "apt", "suite": "ste",
+    "north": "n", "south": "s", "east": "e", "west": "w",
+    "northeast": "ne", "northwest": "nw", "southeast": "se", "southwest": "sw",
+    "pennsylvania": "pa"
+}
+# Dropped only as the last token: "US" inside an address is a route name.
+COUNTRY_TOKENS = ("usa", "us")
+
+# Folds case, punctuation and common street-suffix spellings so that variants
+# of one address share a cache entry.
+def normalize_address(address):
+    tokens = re.sub(r"[^\w\s]", " ", address.lower()).split()
+    if tokens and tokens[-1] in COUNTRY_TOKENS:
+        tokens.pop()
+    return " ".join(ADDRESS_ABBREVIATIONS.get(t, t) for t in tokens)
+
+def _geocode(params):
+    return _google(config.GOOGLE_MAPS_URL + "/maps/api/geocode/json", params)
+
+def _cache_places(out):
+    for result in out["results"]:
+        _geocodes.set("place:" + result["place_id"], { "results": [result], "status": "OK" })
+
+@metrics.timed("geocode")
+def geocode(address):
+    key = "address:" + normalize_address(address)
+    out = _geocodes.get(key)
+    if out is not cache.MISSING:
+        return out
+    return _or_stale(_geocodes, key, lambda: _flights.do("geocode:" + key, lambda: _fill_geocode(key, address)))
+
+def _fill_geocode(key, address):
+    out = _geocode({ "address": address })
+    # Addresses that don't resolve are remembered too, for less time.
+    _geocodes.set(key, out, None if out["results"] else config.GEOCODE_NEGATIVE_TTL)
+    _cache_places(out)
+    return out
+
+@metrics.timed("geocode_place_id")
+def geocode_place_id(place_id):
+    out = _geocodes.get("place:" + place_id)
+    if out is not cache.MISSING:
+        return out
+    return _or_stale(_geocodes, "place:" + place_id, lambda: _fill_place(place_id))
+
+def _fill_place(place_id):
+    out = _geocode({ "place_id": place_id })
+    if out["results"]:
+        _cache_places(out)
+    else:
+        _geocodes.set("place:" + place_id, out, config.GEOCODE_NEGATIVE_TTL)
     return out
 
 def split_from_geocode(data):
@@ -97,35 +332,171 @@ def split_from_geocode(data):
     except KeyError as e:
         return None, None
 
-def get_zillow_data(address, citystatezip, advanced=False):
-    r = requests.post("https://www.zillow.com/webservice/GetDeepSearchResults.htm", data = {
+# Zillow properties are cached by zpid, split by how quickly fields go stale;
+# addresses map to zpids in a separate cache.
+_zillow_ids = cache.Cache("zillow_ids", config.ZILLOW_CACHE_SIZE, config.ZILLOW_STATIC_TTL, config.ZILLOW_CACHE_PATH, config.CACHE_STALE_RETAIN)
+_zillow_static = cache.Cache("zillow_static", config.ZILLOW_CACHE_SIZE, config.ZILLOW_STATIC_TTL, config.ZILLOW_CACHE_PATH, config.CACHE_STALE_RETAIN)
+_zillow_volatile = cache.Cache("zillow_volatile", config.ZILLOW_CACHE_SIZE, config.ZILLOW_VOLATILE_TTL, config.ZILLOW_CACHE_PATH, config.CACHE_STALE_RETAIN)
+_zillow_advanced = cache.Cache("zillow_advanced", config.ZILLOW_CACHE_SIZE, config.ZILLOW_ADVANCED_TTL, config.ZILLOW_CACHE_PATH, config.CACHE_STALE_RETAIN)
+
+# Message codes meaning "no such property" rather than an API failure.
+ZILLOW_NOT_FOUND = (502, 504, 506, 507, 508)
+# GetUpdatedPropertyDetails: restricted, or no updated data for the property.
+ZILLOW_ADVANCED_NOT_FOUND = (501, 502)
+ZILLOW_UNAVAILABLE = (1, 3, 4)
+ZILLOW_QUOTA = (7,)
+ZILLOW_STATIC_FIELDS = ["zpid", "links/homedetails", "links/comparables", "address/street", "address/zipcode",
+                        "address/city", "address/state", "address/latitude", "address/longitude", "finishedSqFt",
+                        "yearBuilt", "bedrooms", "bathrooms", "lastSoldDate", "taxAssessment"]
+ZILLOW_VOLATILE_FIELDS = ["zestimate/amount", "zestimate/valueChange", "zestimate/last-updated"]
+
+# Streams the document and keeps only the text of the listed element paths
+# (relative to the root, e.g. "message/code"). Stops once `stop` closes.
+def extract_xml(content, paths, stop=None):
+    out = {}
+    stack = []
+    for event, elem in ET.iterparse(io.BytesIO(content), events=("start", "end")):
+        if event == "start":
+            stack.append(elem.tag)
+            continue
+        path = "/".join(stack[1:])
+        stack.pop()
+        if path in paths:
+            out[path] = elem.text
+        if path == stop:
+            break
+        elem.clear()
+    return out
+
+# Turns {"links/homedetails": x} into {"links": {"homedetails": x}} with
+# `prefix` stripped from every path.
+def nest(flat, prefix=""):
+    out = {}
+    for path, value in flat.items():
+        if not path.startswith(prefix):
+            continue
+        parts = path[len(prefix):].split("/")
+        node = out
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return out
+
+def _zillow_message(flat):
+    return int(flat.get("message/code") or -1), flat.get("message/text")
+
+# Like _google_check, for the Zillow message code.
+def _zillow_check(r):
+    code, text = _zillow_message(extract_xml(r.content, set(["message/code", "message/text"]), stop="message"))
+    if code in ZILLOW_QUOTA or code in ZILLOW_UNAVAILABLE:
+        raise upstream.api_error(r.url, code, quota=code in ZILLOW_QUOTA, unavailable=code in ZILLOW_UNAVAILABLE, message=text)
+
+def _deep_search(address, citystatezip):
+    r = upstream.post(config.ZILLOW_URL + "/webservice/GetDeepSearchResults.htm", data = {
         "zws-id": ZWSID,
         "address": address,
         "citystatezip": citystatezip
-    })
-    root = ET.fromstring(r.text)
-    msg = root.find("message")
-    msg_code = int(msg.find("code").text)
+    }, check=_zillow_check)
+    prefix = "response/results/result/"
+    paths = set(["message/code", "message/text"] + [prefix + x for x in ZILLOW_STATIC_FIELDS + ZILLOW_VOLATILE_FIELDS])
+    flat = extract_xml(r.content, paths, stop=prefix[:-1])
+    msg_code, msg_text = _zillow_message(flat)
     if msg_code != 0:
-        if msg_code == 502 or msg_code == 504 or msg_code == 506 or msg_code == 507 or msg_code == 508:
+        if msg_code in ZILLOW_NOT_FOUND:
+            return None, None
+        raise upstream.api_error(r.url, msg_code, message=msg_text)
+    return nest({ k: v for k, v in flat.items() if k[len(prefix):] in ZILLOW_STATIC_FIELDS }, prefix), \
+           nest({ k: v for k, v in flat.items() if k[len(prefix):] in ZILLOW_VOLATILE_FIELDS }, prefix)
+
+# Refreshes just the zestimate of a known property.
+def _zestimate(zpid):
+    r = upstream.post(config.ZILLOW_URL + "/webservice/GetZestimate.htm", data = {
+        "zws-id": ZWSID,
+        "zpid": zpid
+    }, check=_zillow_check)
+    prefix = "response/"
+    flat = extract_xml(r.content, set(["message/code", "message/text"] + [prefix + x for x in ZILLOW_VOLATILE_FIELDS]))
+    if _zillow_message(flat)[0] != 0:
+        return None
+    return nest(flat, prefix)
+
+def _fill_zestimate(zpid):
+    volatile = _zestimate(zpid)
+    if volatile is None:
+        return cache.MISSING
+    _zillow_volatile.set(zpid, volatile)
+    return volatile
+
+@metrics.timed("get_zillow_advanced")
+def get_zillow_advanced(zpid):
+    out = _zillow_advanced.get(zpid)
+    if out is not cache.MISSING:
+        return out
+    return _or_stale(_zillow_advanced, zpid, lambda: _fill_advanced(zpid))
+
+# Details are cached in full, "no updated data" answers for a day, and other
+# errors not at all.
+def _fill_advanced(zpid):
+    r = upstream.post(config.ZILLOW_URL + "/webservice/GetUpdatedPropertyDetails.htm", data = {
+        "zws-id": ZWSID,
+        "zpid": int(zpid)
+    }, check=_zillow_check)
+    root = ET.fromstring(r.content)
+    msg_code = int(root.find("message").find("code").text)
+    if msg_code == 0:
+        out = { "advanced": xml_to_dict(root.find("response")) }
+        _zillow_advanced.set(zpid, out)
+    else:
+        out = { "advanced": None, "advanced_error": msg_code }
+        if msg_code in ZILLOW_ADVANCED_NOT_FOUND:
+            _zillow_advanced.set(zpid, out, config.ZILLOW_NEGATIVE_TTL)
+    return out
+
+@metrics.timed("get_zillow_data")
+def get_zillow_data(address, citystatezip, advanced=False):
+    key = normalize_address(address + " " + citystatezip)
+    zpid = _zillow_ids.get(key)
+    if zpid is None:
+        return None
+    static = volatile = cache.MISSING
+    if zpid is not cache.MISSING:
+        static = _zillow_static.get(zpid)
+        volatile = _zillow_volatile.get(zpid)
+        if static is not cache.MISSING and volatile is cache.MISSING:
+            volatile = _or_stale(_zillow_volatile, zpid, lambda: _fill_zestimate(zpid))
+    if static is cache.MISSING or volatile is cache.MISSING:
+        try:
+            static, volatile = _deep_search(address, citystatezip)
+        except upstream.UpstreamError:
+            # Fall back to whatever is cached for a known property.
+            if zpid is cache.MISSING:
+                zpid = _zillow_ids.get(key, stale=True)
+            if zpid is cache.MISSING or zpid is None:
+                raise
+            static = _zillow_static.get(zpid, stale=True)
+            volatile = _zillow_volatile.get(zpid, stale=True)
+            if static is cache.MISSING or volatile is cache.MISSING:
+                raise
+            print("zillow: serving stale {}".format(zpid))
+            return _zillow_out(zpid, static, volatile, advanced)
+        if static is None:
+            _zillow_ids.set(key, None, config.ZILLOW_NEGATIVE_TTL)
             return None
-        raise Exception("zillow api error: {} {}".format(msg_code, msg.find("text").text))
-    resp = root.find("response").find("results").find("result")
-    out = xml_to_dict(resp)
+        zpid = static["zpid"]
+        _zillow_ids.set(key, zpid)
+        _zillow_static.set(zpid, static)
+        _zillow_volatile.set(zpid, volatile)
+    return _zillow_out(zpid, static, volatile, advanced)
+
+def _zillow_out(zpid, static, volatile, advanced):
+    out = { "links": {}, "zestimate": { "amount": None } }
+    out.update(static)
+    out["zestimate"] = dict(out["zestimate"], **volatile.get("zestimate", {}))
     if advanced:
-        r = requests.post("https://www.zillow.com/webservice/GetUpdatedPropertyDetails.htm", data = {
-            "zws-id": ZWSID,
-            "zpid": int(out["zpid"])
-        })
-        root = ET.fromstring(r.text)
-        msg_code = int(root.find("message").find("code").text)
-        if msg_code == 0:
-            out["advanced"] = xml_to_dict(root.find("response"))
-        else:
-            out["advanced"] = None
-            out["advanced_error"] = msg_code
+        out.update(get_zillow_advanced(zpid))
     return out
 
+@metrics.timed("get_overview_data")
 def get_overview_data(laddr, lzip):
     data = get_zillow_data(laddr, lzip)
     if not data:
@@ -144,148 +515,92 @@ def get_overview_data(laddr, lzip):
         "tax": data.get("taxAssessment", None)
     }
 
-def get_public_services(geoinfo):
+# Places categories on /info: the Places types requested together and how many
+# results of each resolved type to keep. Adding a category here is enough for
+# it to be fetched as a report section.
+CATEGORIES = OrderedDict([
+    ("services", { "types": ["library", "post_office", "veterinary_care"], "cap": 4 }),
+    ("transportation", { "types": ["bus_station", "subway_station", "train_station", "transit_station"], "cap": 4, "unique_names": True }),
+    ("parks", { "types": ["park", "zoo", "campground"], "cap": 4 }),
+    ("entertainment", { "types": ["amusement_park", "aquarium", "art_gallery", "movie_theater", "museum"], "cap": 3 }),
+    ("emergency", { "types": ["fire_station", "hospital", "police"], "cap": 4 })
+])
+NEARBY_LIMIT = 20
+
+# Places types in the order type_lookup prefers them, with the label shown.
+TYPE_PRIORITY = [
+    ("hospital", "hospital"),
+    ("fire_station", "fire_station"),
+    ("police", "police"),
+    ("bus_station", "bus_station"),
+    ("subway_station", "subway_station"),
+    ("transit_station", "transit_station"),
+    ("train_station", "train_station"),
+    ("library", "library"),
+    ("post_office", "post_office"),
+    ("veterinary_care", "veterinary_care"),
+    ("park", "park"),
+    ("zoo", "zoo"),
+    ("campground", "campground"),
+    ("amusement_park", "amusement_park"),
+    ("museum", "exhibit"),
+    ("art_gallery", "exhibit"),
+    ("aquarium", "exhibit"),
+    ("movie_theater", "movie_theater")
+]
+TYPE_RANK = { t: (rank, label) for rank, (t, label) in enumerate(TYPE_PRIORITY) }
+
+def type_lookup(t):
+    ranks = [TYPE_RANK[x] for x in t if x in TYPE_RANK]
+    return min(ranks)[1] if ranks else ", ".join(t)
+
+@metrics.timed("get_category")
+def get_category(geoinfo, name):
+    spec = CATEGORIES[name]
     loc = geoinfo["results"][0]["geometry"]["location"]
-    data = get_nearby(loc["lat"], loc["lng"], building="library|post_office|veterinary_care")
+    results = get_nearby(loc["lat"], loc["lng"], building="|".join(spec["types"]))["results"][:NEARBY_LIMIT]
+    if not results:
+        return []
+    dists = haversine_many(loc["lng"], loc["lat"],
+                           [x["geometry"]["location"]["lng"] for x in results],
+                           [x["geometry"]["location"]["lat"] for x in results])
     out = []
-    types = {}
-    for x in data["results"][:20]:
-        loc2 = x["geometry"]["location"]
+    counts = {}
+    seen = set()
+    for x, dist in zip(results, dists):
+        if spec.get("unique_names"):
+            if x["name"] in seen:
+                continue
+            seen.add(x["name"])
         t = type_lookup(x["types"])
-        if t in types:
-            if types[t] == 4: continue
-            types[t] += 1
-        else:
-            types[t] = 1
+        if counts.get(t, 0) >= spec["cap"]:
+            continue
+        counts[t] = counts.get(t, 0) + 1
         out.append({
             "name": x["name"],
             "type": t,
-            "dist": haversine(loc["lng"], loc["lat"], loc2["lng"], loc2["lat"])
+            "dist": float(dist)
         })
     return out
 
+def get_public_services(geoinfo):
+    return get_category(geoinfo, "services")
+
 def get_transportation(geoinfo):
-    loc = geoinfo["results"][0]["geometry"]["location"]
-    data = get_nearby(loc["lat"], loc["lng"], building="bus_station|subway_station|train_station|transit_station")
-    out = []
-    types = {}
-    already_exists = set()
-    for x in data["results"][:20]:
-        if x["name"] in already_exists:
-            continue
-        else:
-            already_exists.add(x["name"])
-        loc2 = x["geometry"]["location"]
-        t = type_lookup(x["types"])
-        if t in types:
-            if types[t] == 4: continue
-            types[t] += 1
-        else:
-            types[t] = 1
-        out.append({
-            "name": x["name"],
-            "type": type_lookup(x["types"]),
-            "dist": haversine(loc["lng"], loc["lat"], loc2["lng"], loc2["lat"])
-        })
-    return out
+    return get_category(geoinfo, "transportation")
 
 def get_parks(geoinfo):
-    loc = geoinfo["results"][0]["geometry"]["location"]
-    data = get_nearby(loc["lat"], loc["lng"], building="park|zoo|campground")
-    out = []
-    types = {}
-    for x in data["results"][:20]:
-        loc2 = x["geometry"]["location"]
-        t = type_lookup(x["types"])
-        if t in types:
-            if types[t] == 4: continue
-            types[t] += 1
-        else:
-            types[t] = 1
-        out.append({
-            "name": x["name"],
-            "type": t,
-            "dist": haversine(loc["lng"], loc["lat"], loc2["lng"], loc2["lat"])
-        })
-    return out
+    return get_category(geoinfo, "parks")
 
 def get_entertainment(geoinfo):
-    loc = geoinfo["results"][0]["geometry"]["location"]
-    data = get_nearby(loc["lat"], loc["lng"], building="amusement_park|aquarium|art_gallery|movie_theater|museum")
-    out = []
-    types = {}
-    for x in data["results"][:20]:
-        loc2 = x["geometry"]["location"]
-        t = type_lookup(x["types"])
-        if t in types:
-            if types[t] == 3: continue
-            types[t] += 1
-        else:
-            types[t] = 1
-        out.append({
-            "name": x["name"],
-            "type": type_lookup(x["types"]),
-            "dist": haversine(loc["lng"], loc["lat"], loc2["lng"], loc2["lat"])
-        })
-    return out
+    return get_category(geoinfo, "entertainment")
 
 def get_emergency(geoinfo):
-    loc = geoinfo["results"][0]["geometry"]["location"]
-    data = get_nearby(loc["lat"], loc["lng"], building="fire_station|hospital|police")
-    out = []
-    types = {}
-    for x in data["results"][:20]:
-        loc2 = x["geometry"]["location"]
-        t = type_lookup(x["types"])
-        if t in types:
-            if types[t] == 4: continue
-            types[t] += 1
-        else:
-            types[t] = 1
-        out.append({
-            "name": x["name"],
-            "type": type_lookup(x["types"]),
-            "dist": haversine(loc["lng"], loc["lat"], loc2["lng"], loc2["lat"])
-        })
-    return out
+    return get_category(geoinfo, "emergency")
 
-def type_lookup(t):
-    if "hospital" in t:
-        return "hospital"
-    if "fire_station" in t:
-        return "fire_station"
-    if "police" in t:
-        return "police"
-    if "bus_station" in t:
-        return "bus_station"
-    if "subway_station" in t:
-        return "subway_station"
-    if "transit_station" in t:
-        return "transit_station"
-    if "train_station" in t:
-        return "train_station"
-    if "library" in t:
-        return "library"
-    if "post_office" in t:
-        return "post_office"
-    if "veterinary_care" in t:
-        return "veterinary_care"
-    if "park" in t:
-        return "park"
-    if "zoo" in t:
-        return "zoo"
-    if "campground" in t:
-        return "campground"
-    if "amusement_park" in t:
-        return "amusement_park"
-    if "museum" in t or "art_gallery" in t or "aquarium" in t:
-        return "exhibit"
-    if "movie_theater" in t:
-        return "movie_theater"
-    return ", ".join(t)
-    
+@metrics.timed("get_census")
 def get_census(address):
-    r = requests.get("https://geocoding.geo.census.gov/geocoder/locations/onelineaddress/", params = {
+    r = upstream.get(config.CENSUS_GEOCODER_URL + "/geocoder/locations/onelineaddress/", params = {
         "address": address,
         "benchmark": "Public_AR_Current",
         "format": "json"
@@ -293,54 +608,64 @@ def get_census(address):
     print(r.text)
     out = r.json()
     
+_schools = cache.Cache("schools", config.SCHOOL_CACHE_SIZE, None, config.SCHOOL_CACHE_PATH, config.CACHE_STALE_RETAIN)
+
+SCHOOL_ITEM = re.compile(r"<(dt|dd)\b[^>]*>(.*?)</\1\s*>", re.S | re.I)
+TAG = re.compile(r"<[^>]+>")
+
+# The school finder answers with a <dl> of (grade range, school name) pairs,
+# or no <dl> for points outside the district.
+def parse_schools(text):
+    start = text.find("<dl")
+    if start < 0:
+        return None
+    end = text.find("</dl", start)
+    items = [html.unescape(TAG.sub("", x[1])).strip() for x in SCHOOL_ITEM.findall(text[start:end if end >= 0 else len(text)])]
+    return [{ "grade": items[i], "name": items[i + 1] } for i in range(0, len(items) - 1, 2)]
+
+# Catchments are redrawn at most once a year, effective at the rollover date.
+def school_year(now=None):
+    now = now or datetime.datetime.now()
+    month, day = config.SCHOOL_YEAR_ROLLOVER
+    return now.year if (now.month, now.day) >= (month, day) else now.year - 1
+
+def next_rollover(now=None):
+    now = now or datetime.datetime.now()
+    month, day = config.SCHOOL_YEAR_ROLLOVER
+    return datetime.datetime(school_year(now) + 1, month, day)
+
+# School assignments for a point, learned per geohash cell: every address in
+# a cell is served the answer first fetched for it, until the school year
+# rolls over.
+@metrics.timed("get_school_assignment")
+def get_school_assignment(lat, lng):
+    now = datetime.datetime.now()
+    key = "{}:{}".format(school_year(now), geohash(lat, lng, config.SCHOOL_CELL_PRECISION))
+    schools = _schools.get(key)
+    if schools is cache.MISSING:
+        schools = _or_stale(_schools, key, lambda: _flights.do("schools:" + key, lambda: _fill_schools(key, lat, lng, now)))
+    return schools
+
+def _fill_schools(key, lat, lng, now):
+    r = upstream.get(config.SCHOOL_FINDER_URL + "/school_finder/ajax/pip/" + str(lat) + '/' + str(lng))
+    schools = parse_schools(r.text)
+    _schools.set(key, schools, (next_rollover(now) - now).total_seconds())
+    return schools
+
+@metrics.timed("get_schools")
 def get_schools(lat, lng):
-    r = requests.get("https://webapps.philasd.org/school_finder/ajax/pip/" + str(lat) + '/' + str(lng))
-    soup = BeautifulSoup(r.text, "html.parser")
-    items = soup.find("dl")
-    if not items:
+    schools = get_school_assignment(lat, lng)
+    if not schools:
         return None
-    items = [x for x in items]
-    schools = []
-    highlist = list()
-    high = ''
-    for i in range(0, len(items), 2):
-        schools.append({ "grade": items[i].text, "name": items[i + 1].text })
-        if int(items[i].text.strip()[-2:]) == 12:
-            highlist = items[i + 1].text.split(",")
-            high = highlist[0] # check that this returns high school last name
-    #high = 'edison'
-    testing = json.load(open('jsondata/keystone.json'))
-    english = list()
-    math = list()
-    science = list()
-    for k in range(len(testing)):
-        curr = ast.literal_eval(testing[k])
-        if high.upper() in curr["school"]:
-            english.append(curr["adv"])
-            english.append(curr["pro"])
-            english.append(curr["basic"])
-            english.append(curr["below"])
-            english = [float(x) for x in english]
-            curr = ast.literal_eval(testing[k + 1])
-            math.append(curr["adv"])
-            math.append(curr["pro"])
-            math.append(curr["basic"])
-            math.append(curr["below"])
-            math = [float(x) for x in math]
-            curr = ast.literal_eval(testing[k + 2])
-            science.append(curr["adv"])
-            science.append(curr["pro"])
-            science.append(curr["basic"])
-            science.append(curr["below"])
-            science = [float(x) for x in science]
-            break
+    high = ""
+    for school in schools:
+        if int(school["grade"][-2:]) == 12:
+            high = school["name"]
+    store = keystone.get()
     out = {
         "schools": schools,
-        "testing": {
-            "english": english,
-            "math": math,
-            "science":science
-        }
+        "testing": store.scores(high, config.KEYSTONE_DISTRICT),
+        "benchmarks": store.benchmarks(high, config.KEYSTONE_DISTRICT)
     }
     return out
 
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+
+import pymongo
+
+import config
+import metrics
+from secret import DB_URL
+
+# One MongoClient (and so one connection pool) per process, shared by all
+# request threads.
+_lock = threading.Lock()
+_client = None
+_pid = None
+
+def get_client():
+    global _client, _pid
+    if _client is None or _pid != os.getpid():
+        with _lock:
+            if _client is None or _pid != os.getpid():
+                # MongoClient isn't fork-safe, so a forked worker builds its own
+                # instead of reusing the parent's sockets. connect=False defers
+                # server discovery to the first operation.
+                _client = pymongo.MongoClient(DB_URL,
+                    maxPoolSize=config.MONGO_POOL_SIZE,
+                    minPoolSize=config.MONGO_MIN_POOL_SIZE,
+                    serverSelectionTimeoutMS=config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    connectTimeoutMS=config.MONGO_CONNECT_TIMEOUT_MS,
+                    socketTimeoutMS=config.MONGO_SOCKET_TIMEOUT_MS,
+                    waitQueueTimeoutMS=config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    event_listeners=[metrics.MongoListener()],
+                    connect=False)
+                _pid = os.getpid()
+    return _client
+
+# Indexes for the incident collections under each supported geo index type
+# (config.GEO_INDEX).
+INDEXES = {
+    "2d": {
+        "crime": [[("coord", pymongo.GEO2D)]],
+        "collisions": [[("coord", pymongo.GEO2D)]]
+    },
+    "2dsphere": {
+        "crime": [[("loc", pymongo.GEOSPHERE), ("time", pymongo.DESCENDING)]],
+        "collisions": [[("loc", pymongo.GEOSPHERE), ("year", pymongo.DESCENDING)]]
+    }
+}
+
+def create_indexes(collection, dataset, index=None):
+    for keys in INDEXES[index or config.GEO_INDEX][dataset]:
+        collection.create_index(keys)
+
+def get_db():
+    return get_client()[config.MONGO_DB]
+
+# Returns (ok, error message).
+def health():
+    try:
+        get_client().admin.command("ping")
+        return True, None
+    except pymongo.errors.PyMongoError as e:
+        return False, str(e)
+
+def close():
+    global _client
+    with _lock:
+        if _client is not None and _pid == os.getpid():
+            _client.close()
+        _client = None
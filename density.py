@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+# Precomputed incident counts per (grid cell, month, category). Run
+# `python density.py build` after import.py; summary() then answers "incidents
+# by type within R miles over the last N months" by summing the cells inside
+# the circle, so its cost depends on R rather than on local crime volume.
+
+import argparse
+import datetime
+import json
+import os
+import time
+
+import numpy as np
+
+import builds
+import config
+from geo import haversine_many, degree_span
+
+COLLISION_TYPE = "Car Accident"
+# Cell (row, col) pairs are packed into one int64 key.
+OFFSET = 1 << 20
+
+def pack(rows, cols):
+    return (np.asarray(rows, dtype=np.int64) + OFFSET) * (OFFSET * 2) + (np.asarray(cols, dtype=np.int64) + OFFSET)
+
+def month_index(year, month):
+    return year * 12 + month - 1
+
+class Grid(object):
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.cell = meta["cell"]
+        self.types = meta["types"]
+        self.keys = np.load(os.path.join(path, "keys.npy"), mmap_mode="r")
+        self.starts = np.load(os.path.join(path, "starts.npy"), mmap_mode="r")
+        self.month = np.load(os.path.join(path, "month.npy"), mmap_mode="r")
+        self.type = np.load(os.path.join(path, "type.npy"), mmap_mode="r")
+        self.count = np.load(os.path.join(path, "count.npy"), mmap_mode="r")
+
+    # Record indices of the cells whose centers lie within `miles`.
+    def records(self, lat, lng, miles):
+        dlat, dlng = degree_span(lat, miles)
+        rows = np.arange(int(np.floor((lat - dlat) / self.cell)), int(np.floor((lat + dlat) / self.cell)) + 1)
+        cols = np.arange(int(np.floor((lng - dlng) / self.cell)), int(np.floor((lng + dlng) / self.cell)) + 1)
+        rows, cols = [x.ravel() for x in np.meshgrid(rows, cols, indexing="ij")]
+        inside = haversine_many(lng, lat, (cols + 0.5) * self.cell, (rows + 0.5) * self.cell) <= miles
+        if not inside.any() or not len(self.keys):
+            return np.empty(0, dtype=np.int64)
+        keys = pack(rows[inside], cols[inside])
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        pos = pos[self.keys[pos] == keys]
+        if not len(pos):
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(self.starts[p], self.starts[p + 1]) for p in pos])
+
+_grids = builds.Loaded(Grid, lambda: config.DENSITY_CHECK_INTERVAL)
+
+# The grid, or None when none has been built. A rebuild is picked up within
+# DENSITY_CHECK_INTERVAL seconds.
+def get():
+    return _grids.get(config.DENSITY_DIR)
+
+# None without a grid, so the section is left out instead of failing.
+def summary(lat, lng, miles, months, now=None):
+    g = get()
+    if g is None:
+        return None
+    now = now or datetime.datetime.now()
+    last = month_index(now.year, now.month)
+    first = last - months + 1
+    idx = g.records(lat, lng, miles)
+    month = g.month[idx]
+    keep = (month >= first) & (month <= last)
+    idx, month = idx[keep], month[keep]
+    count = g.count[idx]
+    by_type = np.bincount(g.type[idx], weights=count, minlength=len(g.types))
+    trend = np.bincount(month - first, weights=count, minlength=months)
+    return {
+        "radius": miles,
+        "months": months,
+        "total": int(count.sum()),
+        "by_type": sorted(({ "type": g.types[i], "count": int(n) } for i, n in enumerate(by_type) if n), key=lambda x: -x["count"]),
+        "trend": [{ "month": "{}-{:02d}".format((first + i) // 12, (first + i) % 12 + 1), "count": int(n) } for i, n in enumerate(trend)]
+    }
+
+# Counts are grouped server-side, so only one row per (cell, month, type)
+# leaves the database.
+def _grouped(collection, cell, year, month, kind):
+    return collection.aggregate([
+        { "$group": {
+            "_id": {
+                "r": { "$floor": { "$divide": [{ "$arrayElemAt": ["$coord", 1] }, cell] } },
+                "c": { "$floor": { "$divide": [{ "$arrayElemAt": ["$coord", 0] }, cell] } },
+                "y": year,
+                "m": month,
+                "t": kind
+            },
+            "n": { "$sum": 1 }
+        } }
+    ], allowDiskUse=True, batchSize=config.MONGO_BATCH_SIZE)
+
+def build(out, cell):
+    import db
+    database = db.get_db()
+    types = {}
+    rows, cols, months, kinds, counts = [], [], [], [], []
+    sources = [
+        _grouped(database.crime, cell, { "$year": "$time" }, { "$month": "$time" }, "$type"),
+        _grouped(database.collisions, cell, "$year", "$month", COLLISION_TYPE)
+    ]
+    for source in sources:
+        for x in source:
+            key = x["_id"]
+            rows.append(int(key["r"]))
+            cols.append(int(key["c"]))
+            months.append(month_index(key["y"], key["m"]))
+            kinds.append(types.setdefault(key["t"], len(types)))
+            counts.append(x["n"])
+    db.close()
+    write(out, cell, rows, cols, months, kinds, counts, sorted(types, key=types.get))
+
+# Writes a grid from parallel lists of (row, col, month index, type code,
+# count) and the type names the codes refer to.
+def write(out, cell, rows, cols, months, kinds, counts, types):
+    keys = pack(rows, cols)
+    order = np.lexsort((np.array(months), keys))
+    keys = keys[order]
+    unique, starts = np.unique(keys, return_index=True)
+    with builds.swap(out) as tmp:
+        np.save(os.path.join(tmp, "keys.npy"), unique)
+        np.save(os.path.join(tmp, "starts.npy"), np.append(starts, len(keys)).astype(np.int64))
+        np.save(os.path.join(tmp, "month.npy"), np.array(months, dtype=np.int32)[order])
+        np.save(os.path.join(tmp, "type.npy"), np.array(kinds, dtype=np.int16)[order])
+        np.save(os.path.join(tmp, "count.npy"), np.array(counts, dtype=np.int32)[order])
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump({ "cell": cell, "types": types, "built": time.time() }, f)
+    print("{} cells, {} (cell, month, type) counts".format(len(unique), len(keys)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the precomputed incident density grid from MongoDB.")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--out", default=config.DENSITY_DIR)
+    parser.add_argument("--cell", type=float, default=config.DENSITY_CELL_DEG)
+    args = parser.parse_args()
+    build(args.out, args.cell)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+EARTH_RADIUS = 3959
+METERS_PER_MILE = 1609.344
+# MongoDB's 2dsphere distances use a 6378.1 km earth radius.
+SPHERE_RADIUS = 6378100 / METERS_PER_MILE
+
+# Great-circle distance in miles from (lng, lat) to each of the points in the
+# lngs/lats arrays.
+def haversine_many(lng, lat, lngs, lats, radius=EARTH_RADIUS):
+    lng, lat = np.radians(lng), np.radians(lat)
+    lngs, lats = np.radians(lngs), np.radians(lats)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * radius * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+# Degrees of latitude and longitude spanned by `miles` around latitude `lat`.
+def degree_span(lat, miles, radius=EARTH_RADIUS):
+    dlat = np.degrees(miles / radius)
+    return dlat, dlat / max(np.cos(np.radians(lat)), 1e-6)
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def geohash(lat, lng, precision):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    out = []
+    bits = 0
+    ch = 0
+    even = True
+    while len(out) < precision:
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        ch <<= 1
+        if value >= mid:
+            ch |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            out.append(GEOHASH_BASE32[ch])
+            bits = 0
+            ch = 0
+    return "".join(out)
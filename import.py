@@ -1,56 +1,223 @@
 #!/usr/bin/env python3
 
-import sys
+import argparse
+import collections
 import csv
-import pymongo
+import hashlib
+import itertools
+import multiprocessing
+import time
 from datetime import datetime
-from secret import DB_URL
 
-do_crime = True
-do_collisions = True
+from pymongo.errors import BulkWriteError
+import db
 
 crime_file = "../crime_philadelphia.csv"
 collisions_file = "../collisions_philadelphia.csv"
 
-client = pymongo.MongoClient(DB_URL)
-db = client["homie"]
+def parse_crime(row):
+    loc = row[-2]
+    if not loc.startswith("POINT"):
+        return None
+    coord = [float(x) for x in loc[7:-1].split(" ")]
+    return {
+        "coord": coord,
+        "loc": { "type": "Point", "coordinates": coord },
+        "type": row[-3],
+        "time": datetime.strptime(row[2], "%m/%d/%Y %I:%M:%S %p")
+    }
 
-if do_crime:
-    crime = db["crime"]
-    crime.drop()
-    crime.create_index([("coord", pymongo.GEO2D)])
+def parse_collision(row):
+    coord = [float(row[0]), float(row[1])]
+    return {
+        "coord": coord,
+        "loc": { "type": "Point", "coordinates": coord },
+        "year": int(row[4]),
+        "month": int(row[5])
+    }
 
-    with open(crime_file) as f:
-        reader = csv.reader(f)
-        print(next(reader, None))
-        count = 0
-        for row in reader:
-            if count > 1000000:
-                break
-            loc = row[-2]
-            if not loc.startswith("POINT"):
-                continue
-            loc = [float(x) for x in loc[7:-1].split(" ")]
-            crime.insert_one({
-                "coord": loc,
-                "type": row[-3],
-                "time": datetime.strptime(row[2], "%m/%d/%Y %I:%M:%S %p")
-            })
-            count += 1
-
-if do_collisions:
-    collisions = db["collisions"]
-    collisions.drop()
-    collisions.create_index([("coord", pymongo.GEO2D)])
-
-    with open(collisions_file) as f:
+PARSERS = {
+    "crime": parse_crime,
+    "collisions": parse_collision
+}
+
+# Orders records within a dataset; the largest value loaded is stored as the
+# dataset's watermark and incremental runs skip anything older.
+WATERMARKS = {
+    "crime": lambda doc: doc["time"],
+    "collisions": lambda doc: doc["year"] * 100 + doc["month"]
+}
+# The watermark for a --since date.
+SINCE = {
+    "crime": lambda date: date,
+    "collisions": lambda date: date.year * 100 + date.month
+}
+
+DUPLICATE_KEY = 11000
+
+# Records are keyed by a hash of their source row, so loading the same row
+# twice is a no-op.
+def row_id(row):
+    return hashlib.sha1("\x1f".join(row).encode("utf-8")).hexdigest()
+
+# Runs in a worker process. Returns (documents, number of rows skipped).
+def parse_rows(dataset, rows, watermark=None):
+    parse = PARSERS[dataset]
+    key = WATERMARKS[dataset]
+    out = []
+    skipped = 0
+    for row in rows:
+        try:
+            doc = parse(row)
+        except (ValueError, IndexError):
+            doc = None
+        if doc is None or (watermark is not None and key(doc) < watermark):
+            skipped += 1
+        else:
+            doc["_id"] = row_id(row)
+            out.append(doc)
+    return out, skipped
+
+# Unordered insert that treats rows already present as success. Returns the
+# number of new documents written.
+def insert(collection, docs):
+    try:
+        return len(collection.insert_many(docs, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        if any(err["code"] != DUPLICATE_KEY for err in e.details["writeErrors"]):
+            raise
+        return e.details["nInserted"]
+
+def get_watermark(database, dataset):
+    state = database["import_state"].find_one({ "_id": dataset })
+    return state["watermark"] if state else None
+
+def set_watermark(database, dataset, watermark):
+    database["import_state"].update_one({ "_id": dataset }, { "$set": {
+        "watermark": watermark,
+        "updated": datetime.utcnow()
+    } }, upsert=True)
+
+def chunks(reader, size):
+    while True:
+        rows = list(itertools.islice(reader, size))
+        if not rows:
+            return
+        yield rows
+
+class Progress(object):
+
+    def __init__(self, dataset, every=10):
+        self.dataset = dataset
+        self.every = every
+        self.start = time.time()
+        self.batches = 0
+        self.inserted = 0
+        self.skipped = 0
+        self.duplicates = 0
+
+    def add(self, inserted, skipped, duplicates=0):
+        self.batches += 1
+        self.inserted += inserted
+        self.skipped += skipped
+        self.duplicates += duplicates
+        if self.batches % self.every == 0:
+            self.report()
+
+    def report(self, done=False):
+        elapsed = max(time.time() - self.start, 1e-9)
+        print("{}: {}{} rows inserted, {} already loaded, {} skipped, {:.0f} rows/s".format(
+            self.dataset, "done, " if done else "", self.inserted, self.duplicates, self.skipped, self.inserted / elapsed))
+
+# Streams the CSV through a pool of parser processes and writes each parsed
+# batch with an unordered insert_many. At most `window` batches are in flight
+# so memory stays bounded however large the file is. Returns the largest
+# watermark seen.
+def stream(collection, dataset, filename, pool, batch_size, window, watermark=None):
+    progress = Progress(dataset)
+    pending = collections.deque()
+    key = WATERMARKS[dataset]
+    high = watermark
+
+    def flush():
+        nonlocal high
+        docs, skipped = pending.popleft().get()
+        inserted = insert(collection, docs) if docs else 0
+        if docs:
+            top = max(key(doc) for doc in docs)
+            high = top if high is None else max(high, top)
+        progress.add(inserted, skipped, len(docs) - inserted)
+
+    with open(filename, newline="") as f:
         reader = csv.reader(f)
         print(next(reader, None))
-        for row in reader:
-            collisions.insert_one({
-                "coord": [float(row[0]), float(row[1])],
-                "year": int(row[4]),
-                "month": int(row[5])
-            })
-
-client.close()
+        for rows in chunks(reader, batch_size):
+            if len(pending) >= window:
+                flush()
+            pending.append(pool.apply_async(parse_rows, (dataset, rows, watermark)))
+        while pending:
+            flush()
+
+    progress.report(done=True)
+    return high
+
+# Full rebuild: load into a shadow collection, index it, then swap it in with
+# a single rename so queries never see a missing or half-built collection.
+def rebuild(database, dataset, filename, pool, batch_size, window):
+    shadow = database[dataset + "_shadow"]
+    shadow.drop()
+    watermark = stream(shadow, dataset, filename, pool, batch_size, window)
+    db.create_indexes(shadow, dataset)
+    shadow.rename(dataset, dropTarget=True)
+    set_watermark(database, dataset, watermark)
+
+# Incremental: append only rows at or past the stored watermark, or past
+# `since` when given. Rows at the watermark itself are re-read and
+# deduplicated by _id.
+def append(database, dataset, filename, pool, batch_size, window, since=None):
+    collection = database[dataset]
+    db.create_indexes(collection, dataset)
+    start = SINCE[dataset](since) if since is not None else get_watermark(database, dataset)
+    if start is None:
+        # Without one every row would be re-read into the live collection.
+        raise ValueError("{} has no watermark to continue from".format(dataset))
+    watermark = stream(collection, dataset, filename, pool, batch_size, window, start)
+    if watermark is not None:
+        set_watermark(database, dataset, watermark)
+
+def main():
+    parser = argparse.ArgumentParser(description="Load crime and collision CSVs into MongoDB.")
+    parser.add_argument("--crime", default=crime_file, help="crime CSV (default: %(default)s)")
+    parser.add_argument("--collisions", default=collisions_file, help="collisions CSV (default: %(default)s)")
+    parser.add_argument("--skip-crime", action="store_true")
+    parser.add_argument("--skip-collisions", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--incremental", action="store_true", help="only load rows newer than the last import")
+    parser.add_argument("--since", type=lambda x: datetime.strptime(x, "%Y-%m-%d"),
+                        help="with --incremental, load rows from this date (YYYY-MM-DD) on instead")
+    args = parser.parse_args()
+    if args.since and not args.incremental:
+        parser.error("--since only applies to --incremental")
+
+    database = db.get_db()
+    datasets = [(name, filename) for name, filename, skip in (("crime", args.crime, args.skip_crime),
+                                                               ("collisions", args.collisions, args.skip_collisions)) if not skip]
+    if args.incremental and not args.since:
+        missing = [name for name, _ in datasets if get_watermark(database, name) is None]
+        if missing:
+            parser.error("no previous import of {} to continue from; run a full import or pass --since".format(", ".join(missing)))
+    pool = multiprocessing.Pool(args.workers)
+    try:
+        for name, filename in datasets:
+            if args.incremental:
+                append(database, name, filename, pool, args.batch_size, args.workers * 2, args.since)
+            else:
+                rebuild(database, name, filename, pool, args.batch_size, args.workers * 2)
+    finally:
+        pool.close()
+        pool.join()
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+# Keystone exam results, loaded once per process and indexed by school name.
+# get() hands out an immutable snapshot, so lookups need no locking. The
+# snapshot is swapped for a fresh one when the data changes on disk.
+#
+# `python keystone.py build` turns the state's school-level spreadsheets (the
+# .xlsx as published, or a CSV export of it) into flat .npy columns plus a
+# precomputed name index, which are opened with mmap. Without a build the
+# legacy jsondata/keystone.json is read instead. Statewide and district
+# benchmarks and percentile ranks are computed once, with the build.
+
+import argparse
+import bisect
+import csv
+import difflib
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+import builds
+import config
+
+SUBJECTS = { "E": "english", "M": "math", "S": "science" }
+LEVELS = ["adv", "pro", "basic", "below"]
+# Words that say nothing about which school is meant.
+STOPWORDS = set(["high", "school", "hs", "sch", "sh", "shs", "the", "of", "and", "at"])
+# Only the grade 11, all-students results are kept.
+GRADE = "11"
+GROUP = "All Students"
+
+def tokenize(name):
+    return [t for t in re.sub(r"[^a-z0-9]+", " ", name.lower()).split() if t not in STOPWORDS]
+
+# Builds the columnar layout from result dicts with id, district, school,
+# subject, year, count and LEVELS keys. Rows are grouped by school; the
+# school's rows run from starts[i] to starts[i + 1].
+def columns(results):
+    ids, schools, districts, subjects = {}, [], {}, {}
+    for x in results:
+        if x["id"] not in ids:
+            ids[x["id"]] = len(schools)
+            schools.append(x)
+        districts.setdefault(x["district"], len(districts))
+        subjects.setdefault(x["subject"], len(subjects))
+    school = np.array([ids[x["id"]] for x in results], dtype=np.int32)
+    year = np.array([x["year"] for x in results], dtype=np.int16)
+    order = np.lexsort((year, school))
+    counts = np.bincount(school, minlength=len(schools))
+    keys = [" ".join(tokenize(x["school"])) for x in schools]
+    postings = {}
+    for i, key in enumerate(keys):
+        for token in key.split():
+            postings.setdefault(token, []).append(i)
+    vocab = sorted(postings)
+    meta = {
+        "names": [x["school"] for x in schools],
+        "keys": keys,
+        "districts": sorted(districts, key=districts.get),
+        "subjects": sorted(subjects, key=subjects.get),
+        "years": sorted(set(int(x["year"]) for x in results)),
+        "vocab": vocab
+    }
+    arrays = {
+        "ids": np.array([x["id"] for x in schools], dtype=np.int32),
+        "district": np.array([districts[x["district"]] for x in schools], dtype=np.int16),
+        "starts": np.append(0, np.cumsum(counts)).astype(np.int32),
+        "year": year[order],
+        "subject": np.array([subjects[x["subject"]] for x in results], dtype=np.int8)[order],
+        "count": np.array([x.get("count") or 0 for x in results], dtype=np.int32)[order],
+        "pct": np.array([[float(x[level]) for level in LEVELS] for x in results], dtype=np.float32).reshape(-1, len(LEVELS))[order],
+        "postings": np.array([i for token in vocab for i in postings[token]], dtype=np.int32),
+        "posting_starts": np.append(0, np.cumsum([len(postings[token]) for token in vocab])).astype(np.int32)
+    }
+    arrays.update(benchmarks(arrays, meta))
+    return meta, arrays
+
+# Share of students scoring above Below Basic, which is what the school page
+# reports.
+def passing(pct):
+    return 100 - np.asarray(pct[:, LEVELS.index("below")], dtype=np.float64)
+
+# Per (year, subject): the statewide and per-district passing rates, weighted
+# by students scored (unweighted when counts are unknown), and each school's
+# percentile rank among all schools.
+def benchmarks(arrays, meta):
+    rate = passing(arrays["pct"])
+    weight = np.where(arrays["count"] > 0, arrays["count"], 1).astype(np.float64)
+    year = np.searchsorted(meta["years"], arrays["year"])
+    group = year * len(meta["subjects"]) + arrays["subject"]
+    ngroups = len(meta["years"]) * len(meta["subjects"])
+    state = np.bincount(group, weights=weight * rate, minlength=ngroups) / np.maximum(np.bincount(group, weights=weight, minlength=ngroups), 1e-9)
+
+    school = np.repeat(np.arange(len(arrays["ids"])), np.diff(arrays["starts"]))
+    district = group * len(meta["districts"]) + arrays["district"][school]
+    totals = np.bincount(district, weights=weight * rate)
+    district_rate = totals[district] / np.bincount(district, weights=weight)[district]
+
+    # Rank within the group: rows strictly below, plus half of the ties.
+    key = group * 1000.0 + rate
+    ordered = np.sort(key)
+    below = np.searchsorted(ordered, key, side="left")
+    ties = np.searchsorted(ordered, key, side="right") - below
+    first = np.searchsorted(np.sort(group), group, side="left")
+    size = np.bincount(group, minlength=ngroups)[group]
+    return {
+        "statewide": state.reshape(len(meta["years"]), len(meta["subjects"])).astype(np.float32),
+        "district_rate": district_rate.astype(np.float32),
+        "percentile": (100.0 * (below - first + 0.5 * ties) / size).astype(np.float32)
+    }
+
+class Store(object):
+
+    def __init__(self, meta, arrays):
+        self.names = meta["names"]
+        self.keys = meta["keys"]
+        self.tokens = [key.split() for key in self.keys]
+        self.districts = meta["districts"]
+        self.subjects = meta["subjects"]
+        self.years = meta["years"]
+        self.vocab = meta["vocab"]
+        for name, values in arrays.items():
+            setattr(self, name, values)
+        self.exact = {}
+        for i, key in enumerate(self.keys):
+            self.exact.setdefault(key, []).append(i)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _posting(self, v):
+        return self.postings[self.posting_starts[v]:self.posting_starts[v + 1]].tolist()
+
+    # Schools with a name token starting with `prefix`.
+    def _prefixed(self, prefix):
+        out = set()
+        v = bisect.bisect_left(self.vocab, prefix)
+        while v < len(self.vocab) and self.vocab[v].startswith(prefix):
+            out.update(self._posting(v))
+            v += 1
+        return out
+
+    # Index of the best match for a school-finder name such as "Franklin,
+    # Benjamin High School", or None. Exact name matches win; otherwise the
+    # first word must match a name token by prefix (or fuzzily if nothing
+    # does). Ties go to the preferred district, then to whichever school
+    # matches more of the remaining words, then to file order.
+    def find(self, name, district=None):
+        tokens = tokenize(name)
+        if not tokens:
+            return None
+        candidates = set(self.exact.get(" ".join(tokens), [])) or self._prefixed(tokens[0])
+        if not candidates:
+            for token in difflib.get_close_matches(tokens[0], self.vocab, n=3, cutoff=0.8):
+                candidates.update(self._posting(bisect.bisect_left(self.vocab, token)))
+        if not candidates:
+            return None
+
+        def score(i):
+            matched = sum(1 for t in tokens[1:] if any(x.startswith(t) for x in self.tokens[i]))
+            return (self.districts[self.district[i]] == district, matched, -i)
+
+        return max(candidates, key=score)
+
+    # Rows of school `i` for `year`, or for its latest year on file.
+    def _rows(self, i, year=None):
+        start, end = int(self.starts[i]), int(self.starts[i + 1])
+        if start == end:
+            return []
+        years = self.year[start:end]
+        year = years.max() if year is None else year
+        return [r for r in range(start, end) if years[r - start] == year and self.subjects[self.subject[r]] in SUBJECTS]
+
+    # Percentages per subject, in LEVELS order.
+    def scores(self, name, district=None, year=None):
+        out = { subject: [] for subject in SUBJECTS.values() }
+        i = self.find(name, district)
+        if i is None:
+            return out
+        for r in self._rows(i, year):
+            out[SUBJECTS[self.subjects[self.subject[r]]]] = [round(float(x), 2) for x in self.pct[r]]
+        return out
+
+    # Per subject, the school's passing rate next to the statewide and
+    # district rates for the same year, and its statewide percentile rank.
+    def benchmarks(self, name, district=None, year=None):
+        out = {}
+        i = self.find(name, district)
+        if i is None:
+            return out
+        for r in self._rows(i, year):
+            code = self.subjects[self.subject[r]]
+            out[SUBJECTS[code]] = {
+                "year": int(self.year[r]),
+                "school": round(float(passing(self.pct[r:r + 1])[0]), 1),
+                "statewide": round(float(self.statewide[self.years.index(int(self.year[r])), self.subject[r]]), 1),
+                "district": round(float(self.district_rate[r]), 1),
+                "percentile": int(round(float(self.percentile[r])))
+            }
+        return out
+
+def load_dir(path):
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    return Store(meta, { name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in meta["arrays"] })
+
+# jsondata/keystone.json is a list of JSON-encoded rows from a single year.
+def load_json(path, year=2015):
+    with open(path) as f:
+        rows = [json.loads(x) for x in json.load(f)]
+    for row in rows:
+        row["year"] = year
+    return Store(*columns(rows))
+
+def load(path):
+    if os.path.isdir(path):
+        return load_dir(path)
+    return load_json(path)
+
+_stores = builds.Loaded(load, lambda: config.KEYSTONE_CHECK_INTERVAL)
+
+# The columnar build when there is one, else the legacy JSON. A rebuild is
+# picked up within KEYSTONE_CHECK_INTERVAL seconds.
+def get(path=None):
+    if path is not None:
+        return _stores.get(path)
+    store = _stores.get(config.KEYSTONE_DIR)
+    if store is None:
+        store = _stores.get(config.KEYSTONE_PATH)
+    if store is None:
+        raise FileNotFoundError("no Keystone data in {} or {}".format(config.KEYSTONE_DIR, config.KEYSTONE_PATH))
+    return store
+
+# Raw spreadsheet rows, as lists of strings. The published .xlsx has a few
+# lines of notes above the header; a CSV export is expected to start at the
+# data.
+def read_rows(path):
+    if path.endswith(".xlsx"):
+        import openpyxl
+        sheet = openpyxl.load_workbook(path, read_only=True).worksheets[0]
+        rows = [["" if c.value is None else str(c.value) for c in row] for row in sheet.iter_rows()]
+    else:
+        with open(path, newline="") as f:
+            rows = list(csv.reader(f))
+    return [row for row in rows if row and row[0].isdigit()]
+
+def parse(rows, year):
+    for row in rows:
+        if row[4] != GRADE or row[5] != GROUP:
+            continue
+        try:
+            pct = [float(x) for x in row[7:11]]
+        except ValueError:
+            # "IS" (fewer than 11 students) or "NA"
+            continue
+        out = { "id": int(row[0]), "district": row[1], "school": row[2], "subject": row[3], "year": year, "count": int(row[6]) }
+        out.update(zip(LEVELS, pct))
+        yield out
+
+# The school year a file covers, from a four-digit year in its name (such as
+# "2015 Keystone Exam School Level Data.xlsx").
+def source_year(path):
+    years = re.findall(r"20\d\d", os.path.basename(path))
+    if not years:
+        raise ValueError("can't tell which year {} covers; pass --year".format(path))
+    return int(years[-1])
+
+def build(out, sources, year=None):
+    results = []
+    for path in sources:
+        rows = list(parse(read_rows(path), year or source_year(path)))
+        print("{}: {} results".format(path, len(rows)))
+        results.extend(rows)
+    meta, arrays = columns(results)
+    meta["arrays"] = list(arrays)
+    meta["built"] = time.time()
+    with builds.swap(out) as tmp:
+        for name, values in arrays.items():
+            np.save(os.path.join(tmp, name + ".npy"), values)
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(meta, f)
+    print("{} schools, {} results, years {}".format(len(meta["names"]), len(results), meta["years"]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the columnar Keystone exam store from the state's school-level spreadsheets.")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("sources", nargs="*", default=["rawdata/2015 Keystone Exam School Level Data.xlsx"], help=".xlsx or .csv files, one or more years")
+    parser.add_argument("--year", type=int, help="year for sources without one in their file name")
+    parser.add_argument("--out", default=config.KEYSTONE_DIR)
+    args = parser.parse_args()
+    build(args.out, args.sources, args.year)
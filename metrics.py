@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+# In-process metrics in the Prometheus text format, plus per-request traces.
+# A trace collects the spans (data fetchers, HTTP calls, Mongo commands) run on
+# behalf of one request; work handed to another thread joins the trace when
+# it's submitted through bind(). Requests slower than SLOW_REQUEST_SECONDS are
+# logged with their spans.
+
+import functools
+import threading
+import time
+
+from pymongo import monitoring
+
+import cache
+import config
+
+# Latency bucket upper bounds, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_metrics = {}
+
+class Counter(object):
+
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        labels = tuple(labels)
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with _lock:
+            return [(self.name, labels, value) for labels, value in sorted(self.values.items())]
+
+class Histogram(object):
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, labels, value):
+        labels = tuple(labels)
+        with _lock:
+            counts, total, n = self.values.get(labels, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[labels] = (counts, total + value, n + 1)
+
+    def samples(self):
+        out = []
+        with _lock:
+            values = sorted((labels, (list(counts), total, n)) for labels, (counts, total, n) in self.values.items())
+        for labels, (counts, total, n) in values:
+            for bound, count in zip(self.buckets, counts):
+                out.append((self.name + "_bucket", labels + (("le", repr(bound)),), count))
+            out.append((self.name + "_bucket", labels + (("le", "+Inf"),), n))
+            out.append((self.name + "_sum", labels, total))
+            out.append((self.name + "_count", labels, n))
+        return out
+
+def counter(name, help):
+    with _lock:
+        return _metrics.setdefault(name, Counter(name, help))
+
+def histogram(name, help):
+    with _lock:
+        return _metrics.setdefault(name, Histogram(name, help))
+
+request_seconds = histogram("homie_request_seconds", "Time to handle an HTTP request, by endpoint.")
+spans = histogram("homie_span_seconds", "Time spent in instrumented work, by kind (data, http, mongo) and name.")
+errors = counter("homie_span_errors_total", "Instrumented work that raised, by kind, name and exception.")
+upstream_responses = counter("homie_upstream_responses_total", "Upstream HTTP responses, by host and status code.")
+upstream_errors = counter("homie_upstream_errors_total", "Error statuses reported by upstream APIs (Google status strings, Zillow message codes), by host.")
+unavailable = counter("homie_sections_unavailable_total", "Report sections that failed or missed their deadline, by section.")
+
+class Trace(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, kind, name, start, duration, error=None):
+        with self._lock:
+            self.spans.append((start - self.start, kind, name, duration, error))
+
+    def summary(self):
+        with self._lock:
+            spans = sorted(self.spans)
+        return "\n".join("  +{:7.0f}ms {:>7.0f}ms  {} {}{}".format(offset * 1000, duration * 1000, kind, name, " ({})".format(error) if error else "")
+                         for offset, kind, name, duration, error in spans)
+
+_local = threading.local()
+
+def current():
+    return getattr(_local, "trace", None)
+
+def begin(name):
+    _local.trace = Trace(name)
+    return _local.trace
+
+def end():
+    trace = current()
+    _local.trace = None
+    return trace
+
+# Wraps fn so that it runs inside the caller's trace, on whatever thread ends
+# up running it.
+def bind(fn):
+    trace = current()
+
+    @functools.wraps(fn)
+    def bound(*args, **kwargs):
+        previous = current()
+        _local.trace = trace
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.trace = previous
+
+    return bound
+
+def record(kind, name, start, duration, error=None):
+    spans.observe((("kind", kind), ("name", name)), duration)
+    if error is not None:
+        errors.inc((("kind", kind), ("name", name), ("error", error)))
+    trace = current()
+    if trace is not None:
+        trace.add(kind, name, start, duration, error)
+
+class span(object):
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, type, value, tb):
+        record(self.kind, self.name, self.start, time.time() - self.start, type.__name__ if type else None)
+
+# Decorator: each call records a span.
+def timed(name, kind="data"):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapped(*args, **kwargs):
+            with span(kind, name):
+                return fn(*args, **kwargs)
+
+        return wrapped
+
+    return decorate
+
+# Nearest-rank percentile (0-100) of `values`; 0 when there are none. For the
+# latency summaries batch.py and the benchmarks print.
+def percentile(values, p):
+    values = sorted(values)
+    return values[int(round(p / 100.0 * (len(values) - 1)))] if values else 0
+
+def finish_request(trace, endpoint):
+    duration = time.time() - trace.start
+    request_seconds.observe((("endpoint", endpoint),), duration)
+    if duration >= config.SLOW_REQUEST_SECONDS:
+        print("slow request: {} took {:.0f}ms\n{}".format(trace.name, duration * 1000, trace.summary()))
+
+# Feeds Mongo command timings into the "mongo" spans. pymongo calls it on the
+# thread that ran the command, so the spans land in that thread's trace.
+class MongoListener(monitoring.CommandListener):
+
+    def __init__(self):
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        name = "{} {}".format(event.command_name, collection) if isinstance(collection, str) else event.command_name
+        with self._lock:
+            self._names[(event.connection_id, event.request_id)] = name
+
+    def _finished(self, event, error=None):
+        with self._lock:
+            name = self._names.pop((event.connection_id, event.request_id), event.command_name)
+        duration = event.duration_micros / 1e6
+        record("mongo", name, time.time() - duration, duration, error)
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event, "CommandFailed")
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format(name, labels, value):
+    if labels:
+        name += "{" + ",".join('{}="{}"'.format(k, _escape(v)) for k, v in labels) + "}"
+    return "{} {}".format(name, value)
+
+def render():
+    lines = []
+    with _lock:
+        metrics = sorted(_metrics.values(), key=lambda m: m.name)
+    for metric in metrics:
+        lines.append("# HELP {} {}".format(metric.name, metric.help))
+        lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+        lines.extend(_format(*sample) for sample in metric.samples())
+    stats = sorted((name, c.stats()) for name, c in cache.caches.items())
+    for field, kind, help in [("hits", "counter", "fresh cache hits"), ("stale", "counter", "expired entries served"),
+                              ("misses", "counter", "cache misses"), ("size", "gauge", "entries held in memory")]:
+        metric = "homie_cache_{}{}".format(field, "_total" if kind == "counter" else "")
+        lines.append("# HELP {} Per cache: {}.".format(metric, help))
+        lines.append("# TYPE {} {}".format(metric, kind))
+        lines.extend(_format(metric, (("cache", name),), s[field]) for name, s in stats)
+    lines.append("# HELP homie_cache_hit_ratio Per cache: share of lookups answered (fresh or stale).")
+    lines.append("# TYPE homie_cache_hit_ratio gauge")
+    for name, s in stats:
+        total = s["hits"] + s["stale"] + s["misses"]
+        lines.append(_format("homie_cache_hit_ratio", (("cache", name),), (s["hits"] + s["stale"]) / float(total) if total else 0))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+# Migrates the crime and collision collections from legacy [lng, lat] pairs
+# under a 2d index to GeoJSON points under compound 2dsphere indexes. Safe to
+# re-run: only documents without a loc field are touched. Set
+# config.GEO_INDEX = "2dsphere" once it has finished.
+
+import argparse
+import time
+
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+import db
+
+def migrate(collection, batch_size):
+    start = time.time()
+    done = 0
+    ops = []
+    for doc in collection.find({ "loc": { "$exists": False } }, { "coord": 1 }, batch_size=batch_size):
+        ops.append(UpdateOne({ "_id": doc["_id"] }, { "$set": { "loc": { "type": "Point", "coordinates": doc["coord"] } } }))
+        if len(ops) >= batch_size:
+            done += collection.bulk_write(ops, ordered=False).modified_count
+            ops = []
+            print("{}: {} documents migrated, {:.0f} docs/s".format(collection.name, done, done / (time.time() - start)))
+    if ops:
+        done += collection.bulk_write(ops, ordered=False).modified_count
+    print("{}: done, {} documents migrated".format(collection.name, done))
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate incident collections to 2dsphere GeoJSON points.")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--drop-2d", action="store_true", help="drop the legacy 2d indexes afterwards")
+    args = parser.parse_args()
+
+    database = db.get_db()
+    for dataset in ("crime", "collisions"):
+        collection = database[dataset]
+        migrate(collection, args.batch_size)
+        db.create_indexes(collection, dataset, "2dsphere")
+        if args.drop_2d:
+            for keys in db.INDEXES["2d"][dataset]:
+                try:
+                    collection.drop_index(keys)
+                except OperationFailure as e:
+                    print("{}: could not drop {}: {}".format(dataset, keys, e))
+    db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+import datetime
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent import futures
+
+import cache
+import config
+import data
+import metrics
+import upstream
+
+# Each section takes the query dict built by make_query and returns the value
+# stored under its name in the template context.
+SECTIONS = OrderedDict([
+    ("overview", lambda q: data.get_overview_data(q["laddr"], q["lzip"])),
+    ("crimes", lambda q: data.get_incidents(q["lat"], q["lng"], area=q.get("area"))),
+    ("safety", lambda q: data.get_safety(q["lat"], q["lng"])),
+    ("schools", lambda q: data.get_schools(q["lat"], q["lng"]))
+])
+for _name in data.CATEGORIES:
+    SECTIONS[_name] = (lambda name: lambda q: data.get_category(q["geoinfo"], name))(_name)
+
+# Value rendered for a section that failed or missed its deadline.
+DEFAULTS = {
+    "overview": None,
+    "crimes": None,
+    "safety": None,
+    "schools": None
+}
+
+_executor = futures.ThreadPoolExecutor(max_workers=config.SECTION_WORKERS)
+
+# Sections by "<place_id>:<section>". The SQLite tier is shared by every
+# worker process on the host.
+_reports = cache.Cache("report", config.REPORT_CACHE_SIZE, config.REPORT_TTL, config.REPORT_CACHE_PATH, config.REPORT_MAX_STALE)
+_flights = cache.SingleFlight()
+_refresher = futures.ThreadPoolExecutor(max_workers=config.REPORT_REFRESH_WORKERS)
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+def make_query(geoinfo, laddr, lzip):
+    loc = geoinfo["results"][0]["geometry"]["location"]
+    return {
+        "geoinfo": geoinfo,
+        "laddr": laddr,
+        "lzip": lzip,
+        "lat": loc["lat"],
+        "lng": loc["lng"]
+    }
+
+# Resolves an address (or an autocomplete place_id) to a query. Returns
+# (query, None), or (None, error message) when it can't be used.
+def locate(address, place_id=None):
+    geoinfo = None
+    if place_id:
+        # Autocomplete already resolved the place; skips geocoding when cached.
+        # A stale or malformed place id falls back to the address.
+        try:
+            geoinfo = data.geocode_place_id(place_id)
+        except upstream.APIError as e:
+            print("place {}: {}".format(place_id, e))
+    if not geoinfo or not geoinfo["results"]:
+        geoinfo = data.geocode(address) if address else None
+    if not geoinfo or not geoinfo["results"]:
+        return None, "We could not geocode the address you provided."
+    laddr, lzip = data.split_from_geocode(geoinfo)
+    if not laddr or not lzip:
+        return None, "We could not find a street address for the location you provided."
+    query = make_query(geoinfo, laddr, lzip)
+    query["place_id"] = geoinfo["results"][0]["place_id"]
+    return query, None
+
+# The part of the report context that needs no sections: enough for the page
+# shell (street view, map) that progressive pages render first.
+def shell(query):
+    return {
+        "current_year": datetime.datetime.now().year,
+        "place_id": query["place_id"],
+        "lat": query["lat"],
+        "lng": query["lng"]
+    }
+
+# The report context shared by the page and the JSON API.
+def build(query, names=None, timings=None, executor=None):
+    fetch = cached_sections if config.REPORT_CACHE else fetch_sections
+    sections, unavailable = fetch(query, names, timings, executor)
+    context = shell(query)
+    context["unavailable"] = unavailable
+    context.update(sections)
+    return context
+
+def section_timeout(name):
+    return config.SECTION_TIMEOUTS.get(name, config.SECTION_TIMEOUT)
+
+def section_ttl(name):
+    return config.REPORT_TTLS.get(name, config.REPORT_TTL)
+
+def _run(name, query):
+    return SECTIONS[name](query)
+
+def _timed(name, query, elapsed, run=_run):
+    start = time.time()
+    try:
+        return run(name, query)
+    finally:
+        elapsed[name] = time.time() - start
+
+def _cache_key(query, name):
+    return "{}:{}".format(query["place_id"], name)
+
+# Computes and caches one section. Concurrent callers for the same place and
+# section wait for a single computation.
+def _run_cached(name, query):
+    key = _cache_key(query, name)
+
+    def compute():
+        # Someone may have filled it between our lookup and now.
+        value = _reports.get(key)
+        if value is not cache.MISSING:
+            return value
+        value = SECTIONS[name](query)
+        _reports.set(key, value, section_ttl(name))
+        return value
+
+    return _flights.do(key, compute)
+
+def _refresh(name, query):
+    key = _cache_key(query, name)
+    try:
+        _run_cached(name, query)
+    except Exception:
+        traceback.print_exc()
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+# Like fetch_sections, but serves sections from the report cache. Stale
+# sections are returned as they are and refreshed in the background; missing
+# ones are fetched (and cached unless they fail).
+def cached_sections(query, names=None, timings=None, executor=None):
+    names = list(names or SECTIONS)
+    context = {}
+    for name in names:
+        value, fresh = _reports.lookup(_cache_key(query, name), config.REPORT_MAX_STALE)
+        if value is cache.MISSING:
+            continue
+        context[name] = value
+        if timings is not None:
+            timings[name] = 0.0
+        if not fresh:
+            key = _cache_key(query, name)
+            with _refreshing_lock:
+                if key in _refreshing:
+                    continue
+                _refreshing.add(key)
+            _refresher.submit(_refresh, name, query)
+    missing = [name for name in names if name not in context]
+    unavailable = []
+    if missing:
+        fetched, unavailable = fetch_sections(query, missing, timings, executor, run=_run_cached)
+        context.update(fetched)
+        # A failed section is better served from however old a copy there is
+        # (an upstream may be down or its breaker open).
+        for name in list(unavailable):
+            value = _reports.get(_cache_key(query, name), stale=True)
+            if value is not cache.MISSING:
+                context[name] = value
+                unavailable.remove(name)
+    return context, unavailable
+
+# Returns (context, unavailable). Sections that raise or miss their deadline
+# get their default value and are listed in unavailable instead of failing the
+# whole report. If `timings` is given, it receives each section's run time in
+# seconds (its deadline, for sections that missed it).
+def fetch_sections(query, names=None, timings=None, executor=None, run=_run):
+    names = list(names or SECTIONS)
+    context = {}
+    unavailable = []
+    elapsed = {}
+    if config.CONCURRENT_SECTIONS:
+        start = time.time()
+        pending = [(name, (executor or _executor).submit(metrics.bind(_timed), name, query, elapsed, run)) for name in names]
+        for name, future in pending:
+            try:
+                limit = section_timeout(name)
+                context[name] = future.result(timeout=None if limit is None else max(0, start + limit - time.time()))
+            except futures.TimeoutError:
+                # The worker can't be interrupted, but nothing waits on it.
+                future.cancel()
+                print("section {} timed out after {}s".format(name, section_timeout(name)))
+                unavailable.append(name)
+            except Exception:
+                traceback.print_exc()
+                unavailable.append(name)
+    else:
+        for name in names:
+            try:
+                context[name] = _timed(name, query, elapsed, run)
+            except Exception:
+                traceback.print_exc()
+                unavailable.append(name)
+    for name in unavailable:
+        metrics.unavailable.inc((("section", name),))
+        context[name] = DEFAULTS.get(name, [])
+    if timings is not None:
+        for name in names:
+            timings[name] = elapsed.get(name, section_timeout(name))
+    return context, unavailable
+
+# Whether building `query` would compute section `name` rather than serve it
+# from the report cache (stale copies are served too).
+def _needs_section(query, name):
+    if not config.REPORT_CACHE:
+        return True
+    return _reports.lookup(_cache_key(query, name), config.REPORT_MAX_STALE)[0] is cache.MISSING
+
+# Reports for many (address, place_id) pairs, yielded as they finish as dicts
+# with the item's index and address plus either the report context or an
+# "error". Work shared between items is done once: each distinct normalized
+# address is geocoded once, each distinct place is built once, and the
+# incidents for the places not already cached come from one query over the
+# union of their areas when there are enough of them close enough together.
+def build_batch(items, workers=None):
+    workers = workers or config.API_BATCH_WORKERS
+    pool = futures.ThreadPoolExecutor(max_workers=workers)
+    sections = futures.ThreadPoolExecutor(max_workers=workers * len(SECTIONS))
+    try:
+        keys = ["place:" + place_id if place_id else "address:" + data.normalize_address(address or "") for address, place_id in items]
+        distinct = OrderedDict()
+        for key, item in zip(keys, items):
+            distinct.setdefault(key, item)
+        located = dict(zip(distinct, pool.map(lambda item: _locate(*item), distinct.values())))
+
+        places = OrderedDict()
+        for i, (key, (address, _)) in enumerate(zip(keys, items)):
+            query, error = located[key]
+            if error:
+                yield { "index": i, "address": address, "error": error }
+            else:
+                places.setdefault(query["place_id"], (query, []))[1].append(i)
+        if not places:
+            return
+
+        # Only places whose crimes section will actually be computed share
+        # the area.
+        uncached = [query for query, _ in places.values() if _needs_section(query, "crimes")]
+        area = None
+        if len(uncached) >= config.API_BATCH_AREA_MIN_PLACES:
+            try:
+                area = data.incident_area([(query["lat"], query["lng"]) for query in uncached])
+            except Exception:
+                # Each place falls back to its own incident query.
+                traceback.print_exc()
+        if area is not None:
+            for query in uncached:
+                query["area"] = area
+        pending = {}
+        for query, indices in places.values():
+            pending[pool.submit(build, query, executor=sections)] = indices
+        for future in futures.as_completed(pending):
+            try:
+                context = future.result()
+            except Exception as e:
+                traceback.print_exc()
+                # Exception text can carry request URLs and their API keys.
+                context = { "error": type(e).__name__ }
+            for i in pending[future]:
+                out = { "index": i, "address": items[i][0] }
+                out.update(context)
+                yield out
+    finally:
+        pool.shutdown(wait=False)
+        sections.shutdown(wait=False)
+
+def _locate(address, place_id):
+    try:
+        return locate(address, place_id)
+    except Exception as e:
+        traceback.print_exc()
+        return None, "Geocoding failed: {}".format(type(e).__name__)
@@ -3,10 +3,13 @@
 from flask import *
 import requests
 import secret
-import data
+import config
+import db
+import metrics
+import report
+import upstream
 import datetime
 import locale
-import traceback
 
 app = Flask(__name__, static_url_path="")
 app.secret_key = secret.SECRET_KEY
@@ -27,48 +30,82 @@ def crop_list(l):
 def to_year(d):
     return int(d.split("/")[-1])
 
+@app.before_request
+def start_trace():
+    metrics.begin("{} {}".format(request.method, request.full_path.rstrip("?")))
+
+@app.teardown_request
+def finish_trace(error=None):
+    trace = metrics.end()
+    if trace is not None:
+        metrics.finish_request(trace, request.endpoint or "unknown")
+
 @app.route("/")
 def index():
     return render_template("index.html", mapskey=secret.GMAPS_FRONT_KEY)
 
 @app.route("/info")
 def info():
-    address = request.args.get("query")
-    import data, secret
-    geoinfo = data.geocode(address)
-    if geoinfo and len(geoinfo["results"]) > 0:
-        laddr, lzip = data.split_from_geocode(geoinfo)
-        if laddr and lzip:
-            place_id = request.args.get("place_id", geoinfo["results"][0]["place_id"])
-            loc = geoinfo["results"][0]["geometry"]["location"]
-            lat = loc["lat"]
-            lng = loc["lng"]
-            try:
-                context = {"mapkey": secret.GMAPS_FRONT_KEY,
-                           "current_year": datetime.datetime.now().year,
-                           "place_id": place_id,
-                           "lat": lat,
-                           "lng": lng,
-                           "overview": data.get_overview_data(laddr, lzip),
-                           "services": data.get_public_services(geoinfo),
-                           "transportation": data.get_transportation(geoinfo),
-                           "crimes": data.get_crimes_and_collisions(lat, lng),
-                           "schools": data.get_schools(lat, lng),
-                           "parks": data.get_parks(geoinfo),
-                           "entertainment": data.get_entertainment(geoinfo),
-                           "emergency": data.get_emergency(geoinfo)
-                }
-            except Exception as e:
-                traceback.print_exc()
-                flash("Error processing request: {}".format(e))
-                return redirect("/")
-            return render_template("info.html", **context)
-        else:
-            flash("Invalid address! We could not find a street address for the location you provided.")
-            return redirect("/")
-    else:
-        flash("Invalid address! We could not geocode the address you provided.")
+    query, error = report.locate(request.args.get("query"), request.args.get("place_id"))
+    if error:
+        flash("Invalid address! " + error)
         return redirect("/")
+    if config.PROGRESSIVE_INFO and request.args.get("progressive") != "0":
+        # Sections are fetched by info.js from info_section as they finish.
+        context = report.shell(query)
+        context["progressive"] = True
+    else:
+        context = report.build(query)
+    context["mapkey"] = secret.GMAPS_FRONT_KEY
+    return render_template("info.html", **context)
+
+# One section of the info page, rendered on its own.
+@app.route("/info/section/<name>")
+def info_section(name):
+    if name not in report.SECTIONS:
+        abort(404)
+    query, error = report.locate(request.args.get("query"), request.args.get("place_id"))
+    if error:
+        return error, 404
+    return render_template("sections/{}.html".format(name), **report.build(query, [name]))
+
+# Same context as /info, as JSON.
+@app.route("/api/info")
+def api_info():
+    query, error = report.locate(request.args.get("query"), request.args.get("place_id"))
+    if error:
+        return jsonify({"error": error}), 404
+    return jsonify(report.build(query))
+
+# POST a JSON list of addresses (strings, or objects with "address" and/or
+# "place_id"), either bare or as {"addresses": [...]}. Responds with one JSON
+# line per address, in completion order, each carrying the address's index.
+@app.route("/api/info/batch", methods=["POST"])
+def api_info_batch():
+    body = request.get_json(force=True, silent=True)
+    addresses = body.get("addresses") if isinstance(body, dict) else body
+    if not isinstance(addresses, list) or not addresses:
+        return jsonify({"error": "expected a non-empty list of addresses"}), 400
+    if len(addresses) > config.API_BATCH_LIMIT:
+        return jsonify({"error": "at most {} addresses per request".format(config.API_BATCH_LIMIT)}), 400
+    items = [(x, None) if isinstance(x, str) else (x.get("address"), x.get("place_id")) for x in addresses if isinstance(x, (str, dict))]
+    if len(items) != len(addresses):
+        return jsonify({"error": "addresses must be strings or objects"}), 400
+
+    def generate():
+        for result in report.build_batch(items):
+            yield json.dumps(result) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app.route("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/health")
+def health():
+    ok, error = db.health()
+    return jsonify({"mongo": "ok" if ok else error, "upstreams": upstream.breakers()}), 200 if ok else 503
 
 if __name__ == "__main__":
     import sys
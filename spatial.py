@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+# Read-only, in-process backend for the incident queries, selected with
+# config.INCIDENT_BACKEND = "local". `python spatial.py build` snapshots the
+# crime and collision collections into flat .npy columns sorted by grid cell.
+# They are opened with mmap, so every worker process on a host shares one copy
+# of the pages through the OS page cache.
+
+import argparse
+import datetime
+import json
+import os
+import time
+
+import numpy as np
+
+import builds
+import config
+from geo import EARTH_RADIUS, SPHERE_RADIUS, haversine_many, degree_span
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+def to_ms(t):
+    return int((t - EPOCH) // datetime.timedelta(milliseconds=1))
+
+def from_ms(ms):
+    return EPOCH + datetime.timedelta(milliseconds=int(ms))
+
+# Distances are computed with the same earth radius as the configured Mongo
+# index so both backends rank and cut identically.
+def earth_radius():
+    return SPHERE_RADIUS if config.GEO_INDEX == "2dsphere" else EARTH_RADIUS
+
+class Dataset(object):
+
+    def __init__(self, meta, columns, cells, starts):
+        self.cell = meta["cell"]
+        self.origin = meta["origin"]
+        self.ncols = meta["ncols"]
+        self.types = meta.get("types", [])
+        self.columns = columns
+        self.cells = cells
+        self.starts = starts
+
+    def __len__(self):
+        return len(self.columns["lng"])
+
+    # Indices of the points in every grid cell overlapping the bounding box of
+    # the circle.
+    def candidates(self, lat, lng, miles, radius):
+        dlat, dlng = degree_span(lat, miles, radius)
+        row0, col0 = self.origin
+        r0 = max(int(np.floor((lat - dlat - row0) / self.cell)), 0)
+        r1 = int(np.floor((lat + dlat - row0) / self.cell))
+        c0 = max(int(np.floor((lng - dlng - col0) / self.cell)), 0)
+        c1 = min(int(np.floor((lng + dlng - col0) / self.cell)), self.ncols - 1)
+        if r1 < r0 or c1 < c0 or not len(self.cells):
+            return np.empty(0, dtype=np.int64)
+        ids = (np.arange(r0, r1 + 1)[:, None] * self.ncols + np.arange(c0, c1 + 1)[None, :]).ravel()
+        pos = np.minimum(np.searchsorted(self.cells, ids), len(self.cells) - 1)
+        pos = pos[self.cells[pos] == ids]
+        if not len(pos):
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(self.starts[p], self.starts[p + 1]) for p in pos])
+
+    # (indices, distances) of the points within `miles`, nearest first.
+    def near(self, lat, lng, miles, mask=None):
+        radius = earth_radius()
+        idx = self.candidates(lat, lng, miles, radius)
+        if mask is not None:
+            idx = idx[mask(idx)]
+        dist = haversine_many(lng, lat, self.columns["lng"][idx], self.columns["lat"][idx], radius)
+        keep = dist <= miles
+        idx, dist = idx[keep], dist[keep]
+        order = np.argsort(dist, kind="mergesort")
+        return idx[order], dist[order]
+
+def load(path):
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    columns = { name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in meta["columns"] }
+    return Dataset(meta, columns, np.load(os.path.join(path, "cells.npy"), mmap_mode="r"), np.load(os.path.join(path, "starts.npy"), mmap_mode="r"))
+
+_datasets = builds.Loaded(load, lambda: config.SPATIAL_CHECK_INTERVAL)
+
+# A rebuild is picked up within SPATIAL_CHECK_INTERVAL seconds.
+def get(name):
+    path = os.path.join(config.SPATIAL_DIR, name)
+    ds = _datasets.get(path)
+    if ds is None:
+        raise FileNotFoundError("no {} dataset in {}; run `python spatial.py build`".format(name, config.SPATIAL_DIR))
+    return ds
+
+# Same grouping as data.band_counts: each distance is counted in the band
+# whose outer edge it's within, { "_id": the band's lower bound, "count": n }.
+def bucket(dist, bands, miles):
+    slot = np.searchsorted(np.array(bands[1:] + [miles], dtype=np.float64), dist, side="left")
+    counts = np.bincount(slot, minlength=len(bands))
+    return [{ "_id": bands[i], "count": int(counts[i]) } for i in range(len(bands)) if counts[i]]
+
+# The following return documents shaped like the $facet output of
+# data.run_facets, from the built store or from
+# the dataset `ds`.
+def crime_facets(lat, lng, limit, miles, since, bands, ds=None):
+    ds = get("crime") if ds is None else ds
+    idx, dist = ds.near(lat, lng, miles, lambda i: ds.columns["time"][i] > to_ms(since))
+    codes = ds.columns["type"][idx]
+    counts = np.bincount(codes, minlength=len(ds.types))
+    by_type = sorted(((ds.types[c], int(n)) for c, n in enumerate(counts) if n), key=lambda x: (-x[1], x[0]))
+    rows = [{
+        "coord": [float(ds.columns["lng"][i]), float(ds.columns["lat"][i])],
+        "type": ds.types[codes[k]],
+        "time": from_ms(ds.columns["time"][i]),
+        "distance": float(dist[k])
+    } for k, i in enumerate(idx[:limit])]
+    return {
+        "rows": rows,
+        "by_type": [{ "_id": t, "count": n } for t, n in by_type],
+        "by_band": bucket(dist, bands, miles)
+    }
+
+def collision_facets(lat, lng, limit, miles, after_year, bands, ds=None):
+    ds = get("collisions") if ds is None else ds
+    idx, dist = ds.near(lat, lng, miles, lambda i: ds.columns["year"][i] > after_year)
+    rows = [{
+        "coord": [float(ds.columns["lng"][i]), float(ds.columns["lat"][i])],
+        "year": int(ds.columns["year"][i]),
+        "month": int(ds.columns["month"][i]),
+        "distance": float(dist[k])
+    } for k, i in enumerate(idx[:limit])]
+    return {
+        "rows": rows,
+        "by_band": bucket(dist, bands, miles)
+    }
+
+# Sorts the columns by grid cell and indexes the non-empty cells and where
+# each one starts. Also used directly for short-lived in-memory datasets.
+def layout(columns, cell, types=None):
+    lng, lat = columns["lng"], columns["lat"]
+    origin = [float(np.floor(lat.min() / cell) * cell), float(np.floor(lng.min() / cell) * cell)] if len(lat) else [0.0, 0.0]
+    ncols = int(np.floor((lng.max() - origin[1]) / cell)) + 1 if len(lng) else 1
+    ids = np.floor((lat - origin[0]) / cell).astype(np.int64) * ncols + np.floor((lng - origin[1]) / cell).astype(np.int64)
+    order = np.argsort(ids, kind="mergesort")
+    ids = ids[order]
+    cells, starts = np.unique(ids, return_index=True)
+    meta = { "cell": cell, "origin": origin, "ncols": ncols, "columns": list(columns), "types": types or [] }
+    return Dataset(meta, { name: values[order] for name, values in columns.items() }, cells, np.append(starts, len(ids)).astype(np.int64))
+
+def write(path, columns, cell, types=None):
+    ds = layout(columns, cell, types)
+    os.makedirs(path)
+    for name, values in ds.columns.items():
+        np.save(os.path.join(path, name + ".npy"), values)
+    np.save(os.path.join(path, "cells.npy"), ds.cells)
+    np.save(os.path.join(path, "starts.npy"), ds.starts)
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({ "cell": cell, "origin": ds.origin, "ncols": ds.ncols, "columns": list(columns), "types": ds.types, "built": time.time() }, f)
+
+# Columns from crime documents, plus the type names their codes refer to.
+def crime_columns(docs):
+    lng, lat, ms, codes, types = [], [], [], [], {}
+    for x in docs:
+        lng.append(x["coord"][0])
+        lat.append(x["coord"][1])
+        ms.append(to_ms(x["time"]))
+        codes.append(types.setdefault(x["type"], len(types)))
+    return {
+        "lng": np.array(lng, dtype=np.float64),
+        "lat": np.array(lat, dtype=np.float64),
+        "time": np.array(ms, dtype=np.int64),
+        "type": np.array(codes, dtype=np.int32)
+    }, sorted(types, key=types.get)
+
+def collision_columns(docs):
+    lng, lat, years, months = [], [], [], []
+    for x in docs:
+        lng.append(x["coord"][0])
+        lat.append(x["coord"][1])
+        years.append(x["year"])
+        months.append(x["month"])
+    return {
+        "lng": np.array(lng, dtype=np.float64),
+        "lat": np.array(lat, dtype=np.float64),
+        "year": np.array(years, dtype=np.int16),
+        "month": np.array(months, dtype=np.int8)
+    }
+
+def build(out, cell, batch_size=10000):
+    import db
+    database = db.get_db()
+    with builds.swap(out) as tmp:
+        columns, types = crime_columns(database.crime.find({}, { "_id": 0, "coord": 1, "type": 1, "time": 1 }, batch_size=batch_size))
+        write(os.path.join(tmp, "crime"), columns, cell, types)
+        print("crime: {} points".format(len(columns["lng"])))
+
+        columns = collision_columns(database.collisions.find({}, { "_id": 0, "coord": 1, "year": 1, "month": 1 }, batch_size=batch_size))
+        write(os.path.join(tmp, "collisions"), columns, cell)
+        print("collisions: {} points".format(len(columns["lng"])))
+    db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the local incident store from MongoDB.")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--out", default=config.SPATIAL_DIR)
+    parser.add_argument("--cell", type=float, default=config.SPATIAL_CELL_DEG)
+    args = parser.parse_args()
+    build(args.out, args.cell)
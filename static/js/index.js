@@ -8,6 +8,9 @@ $(document).ready(function() {
     autocomplete = new google.maps.places.Autocomplete(document.getElementById("search"));
     autocomplete.setTypes(["address"]);
     autocomplete.addListener("place_changed", submitAddress);
+    $search.on("input", function() {
+        $("#place-id").val("");
+    });
 
     $("#search-form").submit(function(e) {
         start_preloader();
@@ -57,5 +60,6 @@ if (!Array.prototype.includes) {
 
 function submitAddress() {
     var place = autocomplete.getPlace();
+    $("#place-id").val(place.place_id || "");
     $("#search-form").submit();
 }
@@ -1,9 +1,11 @@
+var sr;
+var schools_visible = false;
+
 $(document).ready(function() {
     $window = $(window);
     $btn_collapse = $(".button-collapse");
-    $(".timeago").timeago();
 
-    var sr = ScrollReveal();
+    sr = ScrollReveal();
     sr.reveal(".property-img, .map, .card");
     $btn_collapse.sideNav({
         menuWidth: 260
@@ -21,32 +23,86 @@ $(document).ready(function() {
     $(".scrollspy").scrollSpy({
         scrollOffset: 80
     });
-    var chart_data = JSON.parse($("#school-data").text());
+    init_section($(document));
     var options = [
-    	{selector: "#schools", offset: 500, callback: function() {
-      	    $.each(["math", "science", "english"], function(k, v) {
-		new Chart($("#chart-" + v)[0].getContext("2d"), {
-		    type: "pie",
-		    data: {
-			labels: ["Advanced", "Proficient", "Basic", "Failing"],
-			datasets: [
-			    {
-				data: chart_data[v],
-				backgroundColor: [
-				    "#66BB6A",
-				    "#36A2EB",
-				    "#FFCE56",
-				    "#FF6384"
-				]
-			    }
-			]
-		    },
-		    options: {
-			maintainAspectRatio: true
-		    }
-		});
-            });
-	}}
+        {selector: "#schools", offset: 500, callback: function() {
+            schools_visible = true;
+            school_charts();
+        }}
     ];
     Materialize.scrollFire(options);
+
+    // Progressive pages: each section arrives on its own, as soon as it's ready.
+    $(".report-section[data-src]").each(function() {
+        var $section = $(this);
+        $.get($section.data("src")).done(function(html) {
+            $section.html(html);
+        }).fail(function() {
+            $section.find(".progress").replaceWith("<p>This section is currently unavailable. Please try again later.</p>");
+        }).always(function() {
+            var cards = $section[0].querySelectorAll(".card");
+            if (cards.length)
+                sr.reveal(cards);
+            init_section($section);
+            if (schools_visible)
+                school_charts();
+        });
+    });
 });
+
+// Sets up whatever a section's markup needs once it's on the page.
+function init_section($root) {
+    $root.find(".timeago").timeago();
+    var $safety = $root.find("#safety-data");
+    if ($safety.length) {
+        var trend = JSON.parse($safety.text());
+        new Chart($root.find("#chart-safety")[0].getContext("2d"), {
+            type: "line",
+            data: {
+                labels: $.map(trend, function(x) { return x.month; }),
+                datasets: [
+                    {
+                        label: "Incidents",
+                        data: $.map(trend, function(x) { return x.count; }),
+                        borderColor: "#2196F3",
+                        backgroundColor: "rgba(33, 150, 243, 0.2)"
+                    }
+                ]
+            },
+            options: {
+                legend: {display: false}
+            }
+        });
+    }
+}
+
+// Drawn once the schools section is both scrolled to and loaded.
+function school_charts() {
+    var $data = $("#school-data");
+    if (!$data.length || $data.data("drawn"))
+        return;
+    $data.data("drawn", true);
+    var chart_data = JSON.parse($data.text());
+    $.each(["math", "science", "english"], function(k, v) {
+        new Chart($("#chart-" + v)[0].getContext("2d"), {
+            type: "pie",
+            data: {
+                labels: ["Advanced", "Proficient", "Basic", "Failing"],
+                datasets: [
+                    {
+                        data: chart_data[v],
+                        backgroundColor: [
+                            "#66BB6A",
+                            "#36A2EB",
+                            "#FFCE56",
+                            "#FF6384"
+                        ]
+                    }
+                ]
+            },
+            options: {
+                maintainAspectRatio: true
+            }
+        });
+    });
+}
@@ -0,0 +1,32 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import batch
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.path = os.path.join(self.scratch, "out.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+    def write(self, rows, tail=""):
+        with open(self.path, "w") as f:
+            f.write("".join(json.dumps(row) + "\n" for row in rows) + tail)
+
+    def test_partial_reports_are_retried(self):
+        self.write([
+            { "index": 0, "status": "ok", "unavailable": [] },
+            { "index": 1, "status": "ok", "unavailable": ["crimes"] },
+            { "index": 2, "status": "ok", "unavailable": ["schools"] },
+            { "index": 2, "status": "ok", "unavailable": [] },
+            { "index": 3, "status": "not_found" }
+        ], tail='{"index": 4, "sta')
+        self.assertEqual(batch.load_checkpoint(self.path), set([0, 2, 3]))
+        with open(self.path) as f:
+            self.assertTrue(f.read().endswith("\n"))
@@ -0,0 +1,45 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import builds
+
+def read(path):
+    with open(os.path.join(path, "meta.json")) as f:
+        return json.load(f)["version"]
+
+class TestLoaded(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.out = os.path.join(self.scratch, "data")
+        self.loaded = builds.Loaded(read, lambda: 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+    def build(self, version):
+        with builds.swap(self.out) as tmp:
+            with open(os.path.join(tmp, "meta.json"), "w") as f:
+                json.dump({ "version": version }, f)
+
+    def test_never_built(self):
+        self.assertIsNone(self.loaded.get(self.out))
+        self.build(1)
+        self.assertEqual(self.loaded.get(self.out), 1)
+
+    def test_rebuild_picked_up(self):
+        self.build(1)
+        self.assertEqual(self.loaded.get(self.out), 1)
+        self.build(2)
+        self.assertEqual(self.loaded.get(self.out), 2)
+        self.assertFalse(os.path.exists(self.out + ".tmp") or os.path.exists(self.out + ".old"))
+
+    # Between the two renames of a swap the directory is briefly missing.
+    def test_mid_swap_keeps_last_load(self):
+        self.build(1)
+        self.assertEqual(self.loaded.get(self.out), 1)
+        os.rename(self.out, self.out + ".old")
+        self.assertEqual(self.loaded.get(self.out), 1)
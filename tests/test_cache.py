@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import cache
+
+class TestPurge(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.path = os.path.join(self.scratch, "test.sqlite3")
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+    # Recently expired entries survive as stale fallbacks; long-expired ones go.
+    def test_purged_on_open(self):
+        store = cache.SQLiteStore(self.path, "test")
+        now = time.time()
+        store.set("fresh", 1, now + 60)
+        store.set("stale", 2, now - 60)
+        store.set("ancient", 3, now - 7200)
+        store.set("forever", 4, None)
+        store = cache.SQLiteStore(self.path, "test", retain=3600)
+        self.assertEqual(store.lookup("fresh")[0], 1)
+        self.assertEqual(store.lookup("stale")[0], 2)
+        self.assertIs(store.lookup("ancient")[0], cache.MISSING)
+        self.assertEqual(store.lookup("forever")[0], 4)
+
+    def test_purged_while_writing(self):
+        store = cache.SQLiteStore(self.path, "test", retain=3600)
+        store.set("ancient", 3, time.time() - 7200)
+        store._purged = 0
+        store.set("new", 1, time.time() + 60)
+        self.assertIs(store.lookup("ancient")[0], cache.MISSING)
+
+    def test_kept_without_retain(self):
+        store = cache.SQLiteStore(self.path, "test")
+        store.set("ancient", 3, time.time() - 7200)
+        store = cache.SQLiteStore(self.path, "test")
+        self.assertEqual(store.lookup("ancient")[0], 3)
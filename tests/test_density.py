@@ -0,0 +1,53 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import config
+import density
+
+class TestMissingGrid(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = config.DENSITY_DIR
+        self.scratch = tempfile.mkdtemp()
+        config.DENSITY_DIR = os.path.join(self.scratch, "missing")
+
+    def tearDown(self):
+        config.DENSITY_DIR = self.saved
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+    def test_summary_without_grid(self):
+        self.assertIsNone(density.summary(39.95, -75.16, 1, 12))
+        self.assertIsNone(density.get())
+
+class TestRebuild(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = config.DENSITY_DIR, config.DENSITY_CHECK_INTERVAL
+        self.scratch = tempfile.mkdtemp()
+        config.DENSITY_DIR = os.path.join(self.scratch, "density")
+        config.DENSITY_CHECK_INTERVAL = 0
+
+    def tearDown(self):
+        config.DENSITY_DIR, config.DENSITY_CHECK_INTERVAL = self.saved
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+    def build(self, count):
+        cell = config.DENSITY_CELL_DEG
+        row, col = int(np.floor(39.95 / cell)), int(np.floor(-75.16 / cell))
+        month = density.month_index(2016, 9)
+        density.write(config.DENSITY_DIR, config.DENSITY_CELL_DEG, [row], [col], [month], [0], [count], ["Theft"])
+
+    # A server that started before the grid was built picks it up, then
+    # picks up each rebuild, without a restart.
+    def test_rebuilt_grid_is_picked_up(self):
+        now = datetime.datetime(2016, 9, 15)
+        self.assertIsNone(density.summary(39.95, -75.16, 1, 12, now))
+        self.build(3)
+        self.assertEqual(density.summary(39.95, -75.16, 1, 12, now)["total"], 3)
+        self.build(5)
+        self.assertEqual(density.summary(39.95, -75.16, 1, 12, now)["total"], 5)
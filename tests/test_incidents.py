@@ -0,0 +1,61 @@
+import unittest
+
+import numpy as np
+
+import config
+import data
+import spatial
+
+class TestIncidentCounts(unittest.TestCase):
+
+    # $geoNear caps its output at 100 documents before MongoDB 4.2, so the
+    # counts must not go through it.
+    def test_counts_not_capped(self):
+        for index in ("2d", "2dsphere"):
+            pipeline = data.counts_pipeline(39.95, -75.16, data.crime_match(), index=index)
+            self.assertNotIn("$geoNear", repr(pipeline))
+            self.assertNotIn("$limit", repr(pipeline))
+
+    # The date cut runs inside $geoNear, before any cap.
+    def test_rows_filtered_in_geo_near(self):
+        for index in ("2d", "2dsphere"):
+            rows = data.rows_pipeline(39.95, -75.16, data.crime_match(), data.CRIME_FIELDS, 5, index)
+            self.assertIn("query", rows[0]["$geoNear"])
+
+    # The local backend groups exactly as band_counts does.
+    def test_local_bucket_matches(self):
+        edges = data.RADIUS_BANDS[1:] + [data.INCIDENT_RADIUS]
+        dist = np.array([0, 0.2, 0.5, 0.99, 1, 4.9, 5, 9.99, data.INCIDENT_RADIUS])
+        out = {}
+        for i, miles in enumerate(edges):
+            n = int((dist <= miles).sum())
+            out["within_{}".format(i)] = [{ "count": n }] if n else []
+        got = spatial.bucket(dist, data.RADIUS_BANDS, data.INCIDENT_RADIUS)
+        self.assertEqual(got, data.band_counts(out))
+        self.assertEqual(sum(x["count"] for x in got), len(dist))
+
+    def test_stats_cover_every_band(self):
+        stats = data.incident_stats([], [(0, 1), (5, 2)], [(5, 1)])
+        last = stats["by_band"][-1]
+        self.assertEqual((last["min"], last["max"], last["crimes"], last["collisions"]), (5, data.INCIDENT_RADIUS, 2, 1))
+        self.assertEqual(stats["crimes"], 3)
+        self.assertEqual(len(stats["by_band"]), len(data.RADIUS_BANDS))
+
+class TestIncidentArea(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = config.INCIDENT_BACKEND, data.db.get_db
+        config.INCIDENT_BACKEND = "mongo"
+        def no_db():
+            raise AssertionError("queried the database")
+        data.db.get_db = no_db
+
+    def tearDown(self):
+        config.INCIDENT_BACKEND, data.db.get_db = self.saved
+
+    # Philadelphia and Pittsburgh: one query would cover most of the state.
+    def test_spread_out_points_query_separately(self):
+        self.assertIsNone(data.incident_area([(39.95, -75.16), (40.44, -79.99)]))
+
+if __name__ == "__main__":
+    unittest.main()
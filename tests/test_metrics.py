@@ -0,0 +1,16 @@
+import unittest
+
+import metrics
+
+class TestPercentile(unittest.TestCase):
+
+    def test_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(metrics.percentile(values, 0), 1)
+        self.assertEqual(metrics.percentile(values, 50), 51)
+        self.assertEqual(metrics.percentile(values, 95), 95)
+        self.assertEqual(metrics.percentile(values, 100), 100)
+
+    def test_unsorted_and_empty(self):
+        self.assertEqual(metrics.percentile([3, 1, 2], 50), 2)
+        self.assertEqual(metrics.percentile([], 95), 0)
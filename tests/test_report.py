@@ -0,0 +1,119 @@
+import unittest
+
+import config
+import data
+import report
+import upstream
+
+RESULT = {
+    "place_id": "ChIJ-address",
+    "geometry": { "location": { "lat": 39.95, "lng": -75.16 } },
+    "address_components": [
+        { "long_name": "1400", "types": ["street_number"] },
+        { "long_name": "John F Kennedy Boulevard", "types": ["route"] },
+        { "long_name": "Philadelphia", "types": ["locality", "political"] },
+        { "long_name": "Pennsylvania", "types": ["administrative_area_level_1", "political"] },
+        { "long_name": "19107", "types": ["postal_code"] }
+    ]
+}
+
+class TestLocate(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = data.geocode, data.geocode_place_id
+        data.geocode = lambda address: { "results": [RESULT], "status": "OK" }
+
+    def tearDown(self):
+        data.geocode, data.geocode_place_id = self.saved
+
+    # Google answers INVALID_REQUEST or NOT_FOUND for stale or malformed place ids.
+    def test_bad_place_id_falls_back_to_address(self):
+        def invalid(place_id):
+            raise upstream.APIError("maps.googleapis.com: INVALID_REQUEST")
+        data.geocode_place_id = invalid
+        query, error = report.locate("1400 JFK Blvd, Philadelphia, PA", place_id="not-a-place")
+        self.assertIsNone(error)
+        self.assertEqual(query["laddr"], "1400 John F Kennedy Boulevard")
+        self.assertEqual(query["place_id"], "ChIJ-address")
+
+    def test_bad_place_id_without_address(self):
+        def invalid(place_id):
+            raise upstream.APIError("maps.googleapis.com: NOT_FOUND")
+        data.geocode_place_id = invalid
+        query, error = report.locate("", place_id="not-a-place")
+        self.assertIsNone(query)
+        self.assertTrue(error)
+
+    # Outages aren't the place id's fault and still surface.
+    def test_unavailable_not_swallowed(self):
+        def down(place_id):
+            raise upstream.UpstreamUnavailable("maps.googleapis.com: timed out")
+        data.geocode_place_id = down
+        with self.assertRaises(upstream.UpstreamUnavailable):
+            report.locate("1400 JFK Blvd, Philadelphia, PA", place_id="ChIJ-address")
+
+class TestBatchErrors(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = data.geocode
+
+    def tearDown(self):
+        data.geocode = self.saved
+
+    def test_error_text_not_returned(self):
+        def leak(address):
+            raise upstream.UpstreamUnavailable("GET /maps/api/geocode/json?key=SECRET failed")
+        data.geocode = leak
+        out = list(report.build_batch([("1400 JFK Blvd, Philadelphia, PA", None)]))
+        self.assertEqual(len(out), 1)
+        self.assertTrue(out[0]["error"])
+        self.assertNotIn("SECRET", out[0]["error"])
+
+class TestBatchArea(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = report._locate, report.build, data.incident_area, config.REPORT_CACHE
+        self.areas = []
+        report._locate = lambda address, place_id: ({ "place_id": address, "lat": 39.95, "lng": -75.16 }, None)
+        report.build = lambda query, executor=None: { "area": query.get("area") }
+        data.incident_area = lambda points: self.areas.append(points) or "area"
+        config.REPORT_CACHE = True
+
+    def tearDown(self):
+        report._locate, report.build, data.incident_area, config.REPORT_CACHE = self.saved
+        for i in range(config.API_BATCH_AREA_MIN_PLACES + 1):
+            report._reports.pop("batch-test-{}:crimes".format(i))
+
+    def run_batch(self, n):
+        return list(report.build_batch([("batch-test-{}".format(i), None) for i in range(n)]))
+
+    def test_few_places_query_separately(self):
+        out = self.run_batch(config.API_BATCH_AREA_MIN_PLACES - 1)
+        self.assertEqual(self.areas, [])
+        self.assertTrue(all(x["area"] is None for x in out))
+
+    # Places with crimes already cached neither join nor count toward the area.
+    def test_cached_places_left_out(self):
+        report._reports.set("batch-test-0:crimes", {})
+        out = self.run_batch(config.API_BATCH_AREA_MIN_PLACES)
+        self.assertEqual(self.areas, [])
+        report._reports.pop("batch-test-0:crimes")
+        report._reports.set("batch-test-{}:crimes".format(config.API_BATCH_AREA_MIN_PLACES), {})
+        out = self.run_batch(config.API_BATCH_AREA_MIN_PLACES + 1)
+        self.assertEqual(len(self.areas), 1)
+        self.assertEqual(len(self.areas[0]), config.API_BATCH_AREA_MIN_PLACES)
+        by_place = { x["address"]: x["area"] for x in out }
+        self.assertIsNone(by_place["batch-test-{}".format(config.API_BATCH_AREA_MIN_PLACES)])
+        self.assertEqual(by_place["batch-test-0"], "area")
+
+class TestNormalizeAddress(unittest.TestCase):
+
+    def test_variants_share_a_key(self):
+        self.assertEqual(data.normalize_address("1400 John F Kennedy Boulevard, Philadelphia, Pennsylvania, USA"),
+                         data.normalize_address("1400 john f kennedy blvd philadelphia pa"))
+
+    # Only a trailing country is dropped; US inside the address is a route.
+    def test_us_route_kept(self):
+        self.assertNotEqual(data.normalize_address("100 US Highway 1, Philadelphia, PA"),
+                            data.normalize_address("100 Highway 1, Philadelphia, PA"))
+        self.assertEqual(data.normalize_address("100 US Highway 1, Philadelphia, PA, US"), "100 us hwy 1 philadelphia pa")
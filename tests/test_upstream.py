@@ -0,0 +1,108 @@
+import threading
+import unittest
+
+import requests
+
+import config
+import upstream
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, body=None, url="http://fake.test/api"):
+        self.status_code = status_code
+        self.body = body
+        self.url = url
+
+    def json(self):
+        return self.body
+
+class FakeSession(object):
+
+    def __init__(self, respond):
+        self.respond = respond
+
+    def request(self, method, url, **kwargs):
+        return self.respond()
+
+class TestBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = { name: getattr(config, name) for name in ("UPSTREAM_DEDUPE", "UPSTREAM_RETRIES", "UPSTREAM_BREAKER_FAILURES", "UPSTREAM_QUEUE_TIMEOUT") }
+        config.UPSTREAM_DEDUPE = False
+        config.UPSTREAM_RETRIES = 0
+        config.UPSTREAM_BREAKER_FAILURES = 3
+        upstream._breakers.pop("fake.test", None)
+        self.respond = lambda: FakeResponse(200, { "status": "OK" })
+        _, slots = upstream._host("fake.test")
+        upstream._hosts["fake.test"] = (FakeSession(lambda: self.respond()), slots)
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(config, name, value)
+        upstream._hosts.pop("fake.test", None)
+        upstream._breakers.pop("fake.test", None)
+        upstream._buckets.pop("fake.test", None)
+
+    def check(self, r):
+        if r.json()["status"] == "OVER_QUERY_LIMIT":
+            raise upstream.api_error(r.url, "OVER_QUERY_LIMIT", quota=True)
+
+    # A quota error in a 200 response must not count as a success.
+    def test_quota_errors_open_breaker(self):
+        self.respond = lambda: FakeResponse(200, { "status": "OVER_QUERY_LIMIT" })
+        for _ in range(config.UPSTREAM_BREAKER_FAILURES):
+            with self.assertRaises(upstream.QuotaExceeded):
+                upstream.get("http://fake.test/api", check=self.check)
+        self.assertEqual(upstream.breaker("fake.test").state, "open")
+        with self.assertRaises(upstream.CircuitOpen):
+            upstream.get("http://fake.test/api", check=self.check)
+
+    def test_success_resets_failures(self):
+        self.respond = lambda: FakeResponse(200, { "status": "OVER_QUERY_LIMIT" })
+        with self.assertRaises(upstream.QuotaExceeded):
+            upstream.get("http://fake.test/api", check=self.check)
+        self.respond = lambda: FakeResponse(200, { "status": "OK" })
+        upstream.get("http://fake.test/api", check=self.check)
+        self.assertEqual(upstream.breaker("fake.test").failures, 0)
+
+    # A half-open trial that ends in an unexpected error lets the next one through.
+    def test_trial_released_on_other_errors(self):
+        circuit = upstream.breaker("fake.test")
+        circuit.opened = 0
+        def fail():
+            raise ValueError("unexpected")
+        self.respond = fail
+        with self.assertRaises(ValueError):
+            upstream.get("http://fake.test/api")
+        self.assertFalse(circuit.trial)
+        self.respond = lambda: FakeResponse(200, { "status": "OK" })
+        upstream.get("http://fake.test/api")
+        self.assertEqual(circuit.state, "closed")
+
+    # requests puts the whole URL in its messages, API key included.
+    def test_errors_leave_out_the_url(self):
+        def refuse():
+            raise requests.ConnectionError("Max retries exceeded with url: /api?key=SECRET")
+        self.respond = refuse
+        with self.assertRaises(upstream.UpstreamUnavailable) as caught:
+            upstream.get("http://fake.test/api", params={ "key": "SECRET" })
+        self.assertNotIn("SECRET", str(caught.exception))
+
+    # With no queue deadline (batch.py) a rate cap paces requests rather than
+    # failing them.
+    def test_rate_limit_paces_without_deadline(self):
+        config.UPSTREAM_QUEUE_TIMEOUT = None
+        upstream.set_rate_limit("fake.test", 40)
+        failures = []
+        def worker():
+            for _ in range(3):
+                try:
+                    upstream.get("http://fake.test/api")
+                except upstream.UpstreamError as e:
+                    failures.append(e)
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(failures, [])
@@ -0,0 +1,64 @@
+import time
+import unittest
+
+import config
+import data
+import upstream
+
+DETAILS = b"<r><message><text>Request successfully processed</text><code>0</code></message><response><rooms>7</rooms></response></r>"
+
+def answer(code, text="error"):
+    return "<r><message><text>{}</text><code>{}</code></message></r>".format(text, code).encode("utf-8")
+
+class FakeResponse(object):
+
+    def __init__(self, content):
+        self.content = content
+        self.url = config.ZILLOW_URL + "/webservice/GetUpdatedPropertyDetails.htm"
+
+class TestAdvanced(unittest.TestCase):
+
+    ZPID = "999000111"
+
+    def setUp(self):
+        self.saved = upstream.post
+        self.calls = 0
+        self.content = DETAILS
+        def post(url, check=None, **kwargs):
+            self.calls += 1
+            r = FakeResponse(self.content)
+            if check is not None:
+                check(r)
+            return r
+        upstream.post = post
+        data._zillow_advanced.pop(self.ZPID)
+
+    def tearDown(self):
+        upstream.post = self.saved
+        data._zillow_advanced.pop(self.ZPID)
+
+    def test_details_cached(self):
+        self.assertEqual(data.get_zillow_advanced(self.ZPID)["advanced"], { "rooms": "7" })
+        data.get_zillow_advanced(self.ZPID)
+        self.assertEqual(self.calls, 1)
+
+    # An outage raises (and counts against the breaker) instead of hiding
+    # the details for ZILLOW_ADVANCED_TTL.
+    def test_unavailable_not_cached(self):
+        self.content = answer(3, "service unavailable")
+        with self.assertRaises(upstream.UpstreamUnavailable):
+            data.get_zillow_advanced(self.ZPID)
+        self.content = DETAILS
+        self.assertEqual(data.get_zillow_advanced(self.ZPID)["advanced"], { "rooms": "7" })
+
+    def test_no_data_cached_briefly(self):
+        self.content = answer(502)
+        self.assertEqual(data.get_zillow_advanced(self.ZPID)["advanced_error"], 502)
+        value, expires = data._zillow_advanced.memory.lookup(self.ZPID)
+        self.assertEqual(value["advanced_error"], 502)
+        self.assertLessEqual(expires - time.time(), config.ZILLOW_NEGATIVE_TTL)
+
+    def test_other_errors_not_cached(self):
+        self.content = answer(503)
+        self.assertEqual(data.get_zillow_advanced(self.ZPID)["advanced_error"], 503)
+        self.assertIs(data._zillow_advanced.get(self.ZPID), data.cache.MISSING)
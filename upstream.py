@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+# Every call to a third-party API goes through here. Per upstream host there is
+# one keep-alive session shared by every thread in the process, a semaphore
+# capping how many requests may be in flight to it, a circuit breaker, and
+# optionally token buckets capping the request rate for the host and for each
+# API key used with it. Identical requests already in flight are sent once.
+
+import hashlib
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import cache
+import config
+import metrics
+
+_lock = threading.Lock()
+_hosts = {}
+_buckets = {}
+_breakers = {}
+_flights = cache.SingleFlight()
+
+# Request parameters that carry an API key.
+KEY_PARAMS = ("key", "zws-id")
+
+class UpstreamError(requests.RequestException):
+    pass
+
+# Refused locally: too many requests queued or over a rate limit.
+class UpstreamBusy(UpstreamError):
+    pass
+
+# Timed out, unreachable, 5xx, or reporting itself unavailable.
+class UpstreamUnavailable(UpstreamError):
+    pass
+
+# Not attempted because the host's breaker is open.
+class CircuitOpen(UpstreamUnavailable):
+    pass
+
+class QuotaExceeded(UpstreamError):
+    pass
+
+# Any other error status in an otherwise successful response.
+class APIError(UpstreamError):
+    pass
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self.tokens = self.burst
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+    # Takes one token, waiting up to `timeout` seconds for it. Returns False
+    # if none would be available in time.
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+# Opens after `failures` consecutive failures and rejects requests for
+# `cooldown` seconds. Then one trial request is let through: success closes
+# the breaker, failure opens it again.
+class Breaker(object):
+
+    def __init__(self, failures, cooldown):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return "closed"
+        return "half-open" if time.time() - self.opened >= self.cooldown else "open"
+
+    # False if a request must not be sent now; "trial" if it is the one let
+    # through while half-open.
+    def allow(self):
+        with self._lock:
+            if self.opened is None:
+                return True
+            if self.trial or time.time() - self.opened < self.cooldown:
+                return False
+            self.trial = True
+            return "trial"
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+
+    # A trial request that ended without telling either way.
+    def abandon(self):
+        with self._lock:
+            self.trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                self.opened = time.time()
+            self.trial = False
+
+def host_limit(host):
+    return config.UPSTREAM_HOST_LIMITS.get(host, config.UPSTREAM_DEFAULT_LIMIT)
+
+def set_rate_limit(host, rate, burst=None):
+    with _lock:
+        _buckets[host] = TokenBucket(rate, burst or rate) if rate else None
+
+def _bucket(name, limit):
+    with _lock:
+        if name not in _buckets:
+            _buckets[name] = TokenBucket(*limit) if limit else None
+        return _buckets[name]
+
+def _key_bucket(host, kwargs):
+    limit = config.UPSTREAM_KEY_RATE_LIMITS.get(host)
+    if not limit:
+        return None
+    for source in (kwargs.get("params"), kwargs.get("data")):
+        for name in KEY_PARAMS:
+            if isinstance(source, dict) and source.get(name):
+                digest = hashlib.sha1(str(source[name]).encode("utf-8")).hexdigest()[:12]
+                return _bucket("{}#{}".format(host, digest), limit)
+    return None
+
+def breaker(host):
+    with _lock:
+        if host not in _breakers:
+            _breakers[host] = Breaker(config.UPSTREAM_BREAKER_FAILURES, config.UPSTREAM_BREAKER_COOLDOWN)
+        return _breakers[host]
+
+def breakers():
+    with _lock:
+        return { host: b.state for host, b in _breakers.items() }
+
+def _host(host):
+    with _lock:
+        if host not in _hosts:
+            limit = host_limit(host)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=limit)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _hosts[host] = (session, threading.BoundedSemaphore(limit))
+        return _hosts[host]
+
+def backoff(attempt):
+    # "Full jitter": uniform over an exponentially growing window.
+    return random.uniform(0, min(config.UPSTREAM_BACKOFF_MAX, config.UPSTREAM_BACKOFF * 2 ** attempt))
+
+# For errors the caller finds in a response body. Returns the exception to
+# raise; quota and availability errors count against the host's breaker when
+# they are raised from a request's `check`.
+def api_error(url, status, quota=False, unavailable=False, message=None):
+    host = urlsplit(url).netloc
+    metrics.upstream_errors.inc((("host", host), ("status", status)))
+    cls = QuotaExceeded if quota else UpstreamUnavailable if unavailable else APIError
+    return cls("{}: {}{}".format(host, status, " " + message if message else ""))
+
+def _fingerprint(method, url, kwargs):
+    parts = [method, url]
+    for name in ("params", "data"):
+        value = kwargs.get(name)
+        parts.append(repr(sorted(value.items())) if isinstance(value, dict) else repr(value))
+    return "\x1f".join(parts)
+
+# `check`, if given, is called with any response below 500 before the host
+# counts as healthy; it raises (see api_error) for error statuses reported in
+# the body, so those open the breaker like a 5xx would.
+def request(method, url, timeout=None, retries=None, check=None, **kwargs):
+    if config.UPSTREAM_DEDUPE and all(isinstance(kwargs.get(x), (dict, type(None))) for x in ("params", "data")):
+        return _flights.do(_fingerprint(method, url, kwargs), lambda: _request(method, url, timeout, retries, check, **kwargs))
+    return _request(method, url, timeout, retries, check, **kwargs)
+
+def _request(method, url, timeout, retries, check, **kwargs):
+    with metrics.span("http", urlsplit(url).netloc):
+        return _send(method, url, timeout, retries, check, **kwargs)
+
+def _send(method, url, timeout, retries, check, **kwargs):
+    host = urlsplit(url).netloc
+    session, slots = _host(host)
+    if timeout is None:
+        timeout = (config.UPSTREAM_CONNECT_TIMEOUT, config.UPSTREAM_READ_TIMEOUT)
+    if retries is None:
+        retries = config.UPSTREAM_RETRIES
+    circuit = breaker(host)
+    allowed = circuit.allow()
+    if not allowed:
+        raise CircuitOpen("{} is failing; not retrying for up to {}s".format(host, config.UPSTREAM_BREAKER_COOLDOWN))
+    buckets = [b for b in (_bucket(host, config.UPSTREAM_RATE_LIMITS.get(host)), _key_bucket(host, kwargs)) if b is not None]
+    attempt = 0
+    try:
+        while True:
+            # Retries spend tokens too.
+            for bucket in buckets:
+                if not bucket.acquire(timeout=config.UPSTREAM_QUEUE_TIMEOUT):
+                    raise UpstreamBusy("request rate limit for {} exceeded".format(host))
+            if not slots.acquire(timeout=config.UPSTREAM_QUEUE_TIMEOUT):
+                raise UpstreamBusy("too many concurrent requests to {}".format(host))
+            try:
+                r = session.request(method, url, timeout=timeout, **kwargs)
+                metrics.upstream_responses.inc((("host", host), ("status", r.status_code)))
+                if r.status_code < 500:
+                    if check is not None:
+                        check(r)
+                    circuit.success()
+                    return r
+                if attempt >= retries:
+                    raise UpstreamUnavailable("{} answered {}".format(host, r.status_code))
+            except (requests.Timeout, requests.ConnectionError) as e:
+                metrics.upstream_responses.inc((("host", host), ("status", type(e).__name__)))
+                if attempt >= retries:
+                    # Not str(e): requests puts the full URL, API key and all, in it.
+                    raise UpstreamUnavailable("{}: {}".format(host, type(e).__name__))
+            finally:
+                slots.release()
+            attempt += 1
+            time.sleep(backoff(attempt))
+    except (UpstreamUnavailable, QuotaExceeded):
+        circuit.failure()
+        raise
+    finally:
+        # Anything else (turned away locally, some other error) says nothing
+        # about the host's health, but must not leave the trial outstanding.
+        if allowed == "trial":
+            circuit.abandon()
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+def close():
+    with _lock:
+        for session, _ in _hosts.values():
+            session.close()
+        _hosts.clear()